@@ -0,0 +1,148 @@
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+import time
+import traceback
+
+from core.loadData import loadData
+from core.runSegmentation import runSegmentation
+from util import constants
+from util.enums import ScanFormat
+
+
+# Headless batch runner for segmenting many subjects at once
+# Unlike main.py, this does not import PyQt5 or matplotlib so it can be run on machines without a display, e.g.
+#     python batch.py --format WashUDixon /data/MF03*-PRE /data/MF0330-POST
+
+
+# Segment a single subject, this is run inside of a worker process
+# Returns the data path, error message (None if successful) and time taken in seconds
+def segmentSubject(dataPath, format, sliceWorkers, subjectCores, forceBiasCorrection, biasCacheDirectory):
+    tic = time.perf_counter()
+
+    # Options are set in the worker process since spawned workers do not inherit them from the parent process
+    constants.sliceWorkers = sliceWorkers
+    constants.subjectCores = subjectCores
+    constants.forceBiasCorrection = forceBiasCorrection
+    constants.biasCacheDirectory = biasCacheDirectory
+
+    print('Beginning segmentation for %s' % dataPath)
+
+    # Attempt to load the data from the data path
+    # Data is not cached since each subject is only loaded once
+    try:
+        data = loadData(dataPath, format, saveCache=False)
+    except Exception:
+        print('Unable to load data from %s. Skipping...' % dataPath)
+        print(traceback.format_exc())
+        return dataPath, 'Unable to load data', time.perf_counter() - tic
+
+    # Set constant pathDir to be the current data path to allow writing/reading from the current directory
+    constants.pathDir = dataPath
+
+    # Run segmentation algorithm
+    try:
+        runSegmentation(data, format)
+    except Exception:
+        print('Unable to run segmentation algorithm on %s. Skipping...' % dataPath)
+        print(traceback.format_exc())
+        return dataPath, 'Unable to run segmentation algorithm', time.perf_counter() - tic
+
+    return dataPath, None, time.perf_counter() - tic
+
+
+# Expand the subject arguments into a list of directories
+# Each argument may be a directory or a glob pattern matching multiple directories. Duplicates are removed while keeping
+# the order they were given in
+def getSubjectDirectories(subjects):
+    directories = []
+
+    for subject in subjects:
+        # Sort the glob results so the order of the subjects is predictable
+        # If the pattern matches nothing, keep it as is so that it is reported as an invalid directory
+        matches = sorted(glob.glob(subject)) or [subject]
+
+        for match in matches:
+            match = os.path.normpath(match)
+
+            if match not in directories:
+                directories.append(match)
+
+    return directories
+
+
+def parseArguments(args=None):
+    parser = argparse.ArgumentParser(description='Segment adipose tissue for a batch of subjects without a GUI')
+    parser.add_argument('subjects', nargs='+',
+                        help='Subject directories to segment, glob patterns such as /data/MF03* are expanded')
+    parser.add_argument('-f', '--format', required=True, choices=[format.name for format in ScanFormat],
+                        help='Scan format of the subjects')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='Number of subjects to segment at once, 0 uses one per available CPU core divided by the '
+                             'number of slice workers (default: %(default)s)')
+    parser.add_argument('-s', '--slice-workers', type=int, default=1,
+                        help='Number of worker processes used for the slices of each subject (default: %(default)s)')
+    parser.add_argument('--force-bias-correction', action='store_true',
+                        help='Regenerate the bias corrected images even if they already exist')
+    parser.add_argument('--bias-cache-dir', default=None,
+                        help='Directory of the bias correction cache shared by all subjects, e.g. on a shared file '
+                             'system so that the machines of a cluster share it (default: ~/.cache of the user)')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parseArguments(args)
+
+    format = ScanFormat[args.format]
+
+    # Invalid directories are reported as failures without being sent to the workers
+    directories = getSubjectDirectories(args.subjects)
+    results = [(directory, 'Invalid directory', 0.0) for directory in directories if not os.path.isdir(directory)]
+    directories = [directory for directory in directories if os.path.isdir(directory)]
+
+    # Split the CPU cores among the subjects so that the subject and slice workers do not oversubscribe the CPU
+    jobs = args.jobs
+    if jobs <= 0:
+        jobs = max((os.cpu_count() or 1) // max(args.slice_workers, 1), 1)
+
+    jobs = max(min(jobs, len(directories)), 1)
+
+    # Each subject gets an even share of the CPU cores for the threads of the N4 bias correction
+    subjectCores = max((os.cpu_count() or 1) // jobs, 1)
+
+    tic = time.perf_counter()
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = {executor.submit(segmentSubject, directory, format, args.slice_workers, subjectCores,
+                                   args.force_bias_correction, args.bias_cache_dir): directory
+                   for directory in directories}
+
+        for future in concurrent.futures.as_completed(futures):
+            # Errors from the segmentation are caught in the worker, this catches the worker process itself dying
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append((futures[future], 'Worker process failed: %s' % e, 0.0))
+
+    toc = time.perf_counter()
+
+    # Print summary of each subject, sorted by subject path
+    results.sort(key=lambda result: result[0])
+    failures = [result for result in results if result[1] is not None]
+
+    print()
+    print('Segmentation summary (%i subjects, %i failed, %f seconds)' % (len(results), len(failures), toc - tic))
+
+    for dataPath, error, timeTaken in results:
+        print('%-6s %10.2fs  %s%s' % ('OK' if error is None else 'FAILED', timeTaken, dataPath,
+                                      '' if error is None else ' (%s)' % error))
+
+    # Exit with non-zero status if any subject failed so batch schedulers can detect it
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
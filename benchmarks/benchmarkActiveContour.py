@@ -0,0 +1,122 @@
+import time
+
+import cv2
+import numpy as np
+import skimage.draw
+import skimage.segmentation
+
+from benchmarks.phantom import createPhantom
+from util import constants
+from util.activeContour import activeContour, getSystemInverse
+from util.util import createBodyMasks, createFatVoidMasks, largestComponent, removeSmallObjects
+
+# Benchmark of the in-project active contour against scikit-image for the snake used to find the fat void boundary
+# The fat void masks and initial contours are made the same way as the segmentation algorithms: binary fat void masks
+# with sharp edges from the fat and water masks, and the sparse outline of the body from cv2.findContours. The
+# active contour is run with the spline derivatives evaluated at the snake points (the default) and with the gradient
+# evaluated on the pixel grid (constants.snakeGridGradient), which settles differently on the sharp edges
+# Requires scikit-image 0.16 or later for the (row, column) coordinates used when calling scikit-image
+# Run from the root of the repository: python -m benchmarks.benchmarkActiveContour
+
+# Snake parameters used in the segmentation algorithms
+alpha, beta, gamma = 0.70, 0.01, 0.1
+
+
+def getSlicesData(fatImage, waterImage):
+    # Thresholded fat and water images stand in for the K-means masks
+    fatImageMasks, waterImageMasks = fatImage > 0.5, waterImage > 0.5
+    slices = range(fatImage.shape[0])
+
+    bodyMasks = largestComponent(createBodyMasks(fatImageMasks, waterImageMasks, slices))
+    fatVoidMasks = removeSmallObjects(createFatVoidMasks(fatImageMasks, slices),
+                                      constants.thresholdAbdominalFatVoidsArea)
+
+    slicesData = []
+    for bodyMask, fatVoidMask in zip(bodyMasks, fatVoidMasks):
+        # Largest contour of the body in Cartesian format (x, y) found like the segmentation algorithms
+        contours = cv2.findContours(bodyMask.astype(np.uint8), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        contour = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(float)
+
+        slicesData.append((fatVoidMask.astype(np.uint8) * 255, contour))
+
+    return slicesData
+
+
+def fillContour(contour, shape):
+    mask = np.zeros(shape, bool)
+    rr, cc = skimage.draw.polygon(contour[:, 1], contour[:, 0], shape)
+    mask[rr, cc] = True
+
+    return mask
+
+
+def compare(snake, referenceSnake, shape):
+    # Largest distance between the points of two snakes and the Dice coefficient of the filled snakes
+    mask, referenceMask = fillContour(snake, shape), fillContour(referenceSnake, shape)
+
+    return np.linalg.norm(snake - referenceSnake, axis=1).max(), \
+        2 * (mask & referenceMask).sum() / (mask.sum() + referenceMask.sum())
+
+
+def main():
+    fatImage, waterImage = createPhantom((10, 256, 256))
+    slices = getSlicesData(fatImage, waterImage)
+
+    skimageTime, coldTime, warmTime, gridTime = 0.0, 0.0, 0.0, 0.0
+    totalIterations, totalGridIterations = 0, 0
+    maxDistance, diceScores = 0.0, []
+    maxGridDistance, gridDiceScores = 0.0, []
+
+    for image, contour in slices:
+        # Parameters are given positionally since their names differ between scikit-image versions
+        tic = time.perf_counter()
+        skimageSnake = skimage.segmentation.active_contour(image, contour[:, ::-1], alpha, beta, 0.0, 1.0, gamma, 1.0,
+                                                           2500, 0.1)[:, ::-1]
+        skimageTime += time.perf_counter() - tic
+
+        # Cold run includes computing the system inverse, warm run reuses it from the cache
+        getSystemInverse.cache_clear()
+        tic = time.perf_counter()
+        activeContour(image, contour, alpha=alpha, beta=beta, gamma=gamma, gridGradient=False)
+        coldTime += time.perf_counter() - tic
+
+        tic = time.perf_counter()
+        snake, iterations = activeContour(image, contour, alpha=alpha, beta=beta, gamma=gamma, gridGradient=False)
+        warmTime += time.perf_counter() - tic
+        totalIterations += iterations
+
+        tic = time.perf_counter()
+        gridSnake, gridIterations = activeContour(image, contour, alpha=alpha, beta=beta, gamma=gamma,
+                                                  gridGradient=True)
+        gridTime += time.perf_counter() - tic
+        totalGridIterations += gridIterations
+
+        # Compare the resulting snakes point by point and as filled masks, both to scikit-image
+        distance, dice = compare(snake, skimageSnake, image.shape)
+        maxDistance = max(maxDistance, distance)
+        diceScores.append(dice)
+
+        distance, dice = compare(gridSnake, skimageSnake, image.shape)
+        maxGridDistance = max(maxGridDistance, distance)
+        gridDiceScores.append(dice)
+
+    count = len(slices)
+    print('Slice shape: %s, %i slices, %i to %i contour points' % (image.shape, count,
+                                                                   min(len(contour) for _, contour in slices),
+                                                                   max(len(contour) for _, contour in slices)))
+    print('%-30s %f seconds per slice' % ('scikit-image:', skimageTime / count))
+    print('%-30s %f seconds per slice (%.1fx faster)' % ('activeContour (cold):', coldTime / count,
+                                                         skimageTime / coldTime))
+    print('%-30s %f seconds per slice (%.1fx faster), %.1f iterations per slice' %
+          ('activeContour (cached):', warmTime / count, skimageTime / warmTime, totalIterations / count))
+    print('%-30s %f seconds per slice (%.1fx faster), %.1f iterations per slice' %
+          ('activeContour (grid, cached):', gridTime / count, skimageTime / gridTime, totalGridIterations / count))
+
+    # Differences to scikit-image as the maximum point distance and minimum Dice coefficient of the filled snakes
+    print('%-30s %f pixels maximum distance, %f minimum Dice coefficient' % ('activeContour vs scikit-image:',
+                                                                            maxDistance, min(diceScores)))
+    print('%-30s %f pixels maximum distance, %f minimum Dice coefficient' % ('grid vs scikit-image:',
+                                                                            maxGridDistance, min(gridDiceScores)))
+
+if __name__ == '__main__':
+    main()
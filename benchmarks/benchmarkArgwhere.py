@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+
+from util.util import maxargwhere, minargwhere, nearestargwhere
+
+# Micro-benchmark of maxargwhere, minargwhere and nearestargwhere against the original implementations that used
+# np.apply_along_axis, on a single lung mask slice and on a whole stack of slices at once
+# Run from the root of the repository: python -m benchmarks.benchmarkArgwhere
+
+
+def legacyMaxargwhere(array, axis=0):
+    def func(a):
+        x = np.argwhere(a)
+        return -1 if len(x) == 0 else x.max()
+
+    return np.apply_along_axis(func, axis, array)
+
+
+def legacyMinargwhere(array, axis=0):
+    def func(a):
+        x = np.argwhere(a)
+        return -1 if len(x) == 0 else x.min()
+
+    return np.apply_along_axis(func, axis, array)
+
+
+def legacyNearestargwhere(array, index=0, axis=0):
+    def func(a):
+        x = np.argwhere(a)
+        if len(x) == 0:
+            return -1
+
+        # Return a scalar rather than a 1 element array so the output shape does not depend on the first row
+        return x[np.abs(x - index).argmin()][0]
+
+    return np.apply_along_axis(func, axis, array)
+
+
+def createLungMasks(shape, seed=0):
+    # Two elliptical lungs per slice with some empty rows above and below them, like the lung masks in the thoracic
+    # region, plus random speckle so that every row is not a simple interval
+    random = np.random.RandomState(seed)
+
+    slices, rows, columns = shape
+    y, x = np.mgrid[:rows, :columns]
+
+    masks = np.zeros(shape, bool)
+    for slice in range(slices):
+        for centerX in (columns * 0.3, columns * 0.7):
+            masks[slice] |= ((y - rows * 0.5) / (rows * 0.3)) ** 2 + ((x - centerX) / (columns * 0.15)) ** 2 <= 1
+
+    masks |= random.rand(*shape) < 0.001
+
+    return masks
+
+
+def timeFunction(func, *args, repeat=3, **kwargs):
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = func(*args, **kwargs)
+        times.append(time.perf_counter() - tic)
+
+    return min(times), result
+
+
+def main():
+    masks = createLungMasks((40, 512, 512))
+    columns = masks.shape[2]
+
+    functions = [
+        ('maxargwhere', legacyMaxargwhere, maxargwhere, {}),
+        ('minargwhere', legacyMinargwhere, minargwhere, {}),
+        ('nearestargwhere', legacyNearestargwhere, nearestargwhere, {'index': columns // 2}),
+    ]
+
+    print('Mask shape: %s, searching along the columns' % (masks.shape,))
+    print('%-16s %-7s %12s %12s %10s %10s' % ('Function', 'Input', 'Legacy (s)', 'New (s)', 'Speedup', 'Identical'))
+
+    for name, legacyFunc, newFunc, kwargs in functions:
+        # Single slice as used by segmentThoracicSlice and the whole stack in a single call
+        for inputName, array in (('slice', masks[0]), ('stack', masks)):
+            legacyTime, legacyResult = timeFunction(legacyFunc, array, axis=-1, **kwargs)
+            newTime, newResult = timeFunction(newFunc, array, axis=-1, **kwargs)
+
+            print('%-16s %-7s %12f %12f %9.1fx %10s' % (name, inputName, legacyTime, newTime, legacyTime / newTime,
+                                                        np.array_equal(legacyResult, newResult)))
+
+
+if __name__ == '__main__':
+    main()
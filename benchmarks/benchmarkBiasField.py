@@ -0,0 +1,97 @@
+import concurrent.futures
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.phantom import createPhantom
+from util import constants, profiling
+
+# Benchmark of the methods used to bring the bias field found by N4 on the shrinked image back to the size of the
+# original image (constants.biasFieldUpsampling). The phantom is multiplied by a smooth synthetic bias field so that
+# there is something for N4 to find
+# Each method is run in a fresh process so that the peak memory (maximum resident set size, only available on Unix) is
+# not affected by the other methods. The peak memory is reported relative to the process after loading the image and
+# includes shrinking the image and N4, which are the same for both methods. The size of the bias field that is returned
+# is reported separately
+# Run from the root of the repository: python -m benchmarks.benchmarkBiasField
+
+shape = (48, 320, 320)
+shrinkFactor = 4
+
+
+def createBiasField(shape):
+    # Smooth bias field that is brightest at the front left of the body and changes slowly from slice to slice
+    z, y, x = np.mgrid[:shape[0], :shape[1], :shape[2]]
+    distance = (y - 0.25 * shape[1]) ** 2 + (x - 0.3 * shape[2]) ** 2
+
+    return (1.0 + 0.4 * np.exp(-distance / (2 * (0.35 * shape[2]) ** 2))) * (1.0 + 0.2 * z / shape[0])
+
+
+def createBiasedImage(shape):
+    fatImage, waterImage = createPhantom(shape)
+
+    return fatImage * createBiasField(shape)
+
+
+def getPeakMemory():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def estimate(filename, method):
+    # Imported here so that the worker process only loads what it needs
+    from core.biasCorrection import estimateBiasField
+
+    # Header is only used for the debug files, which are not written
+    constants.debugBiasCorrection = False
+    constants.nrrdHeaderDict = {'space directions': np.eye(3)}
+    constants.biasFieldUpsampling = method
+    constants.trace = True
+
+    image = np.load(filename)
+    baseline = getPeakMemory()
+
+    profiling.reset()
+    tic = time.perf_counter()
+    biasField = estimateBiasField(image, shrinkFactor, 'benchmark')
+    toc = time.perf_counter()
+
+    # Time taken to bring the bias field back to the size of the original image, recorded as a span of the trace
+    upsampleTime = sum(record['wallTime'] for record in profiling.getProfiler().records
+                       if record['stage'] == 'upsample')
+
+    return toc - tic, upsampleTime, getPeakMemory() - baseline, biasField
+
+
+def main():
+    image = createBiasedImage(shape)
+
+    print('Image shape: %s, shrink factor: %i' % (image.shape, shrinkFactor))
+    print('%-10s %12s %14s %16s %12s %14s %14s' % ('Method', 'Total (s)', 'Upsample (s)', 'Peak memory (MB)',
+                                                   'Field (MB)', 'Edge slice min', 'Diff in body'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'image.npy')
+        np.save(filename, image)
+
+        body = image > 0.3
+        reference = None
+        for method in ['zoom', 'bspline']:
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                totalTime, upsampleTime, peakMemory, biasField = executor.submit(estimate, filename, method).result()
+
+            # First method is the zoom that has been used so far and is used as the reference
+            if reference is None:
+                reference = biasField
+
+            print('%-10s %12f %14f %16.1f %12.1f %14.3f %14.4f' % (method, totalTime, upsampleTime, peakMemory,
+                                                                   biasField.nbytes / 2 ** 20,
+                                                                   min(biasField[0].min(), biasField[-1].min()),
+                                                                   np.abs(biasField - reference)[body].mean()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.benchmarkActiveContour import alpha, beta, gamma, fillContour
+from benchmarks.phantom import createPhantom
+from util.activeContour import activeContour, resampleInitialContour
+
+# Benchmark of the time/accuracy trade-off of resampling the initial contour of the snake to a fixed number of points or
+# spacing between points (constants.snakeContourPoints and constants.snakeContourSpacing)
+# Accuracy is measured against the abdominal mask found from the unmodified outline of the body mask
+# Run from the root of the repository: python -m benchmarks.benchmarkContourResampling
+
+# Settings to compare as (number of points, spacing in pixels)
+settings = [(None, None), (100, None), (200, None), (400, None), (None, 1.0), (None, 2.0), (None, 4.0)]
+
+
+def getSliceData(fatImage, waterImage):
+    bodyMask = (fatImage + waterImage) > 0.5
+    fatVoidMask = bodyMask & (fatImage < 0.5)
+
+    # Find the outline of the body mask the same way as the segmentation algorithms
+    # The contours are the second to last return value in all versions of OpenCV
+    contours = cv2.findContours(bodyMask.astype(np.uint8), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    contour = max(contours, key=cv2.contourArea)
+    contour = contour.reshape(contour.shape[::2])
+
+    return fatVoidMask.astype(np.uint8) * 255, contour
+
+
+def runSetting(slices, numPoints, spacing):
+    masks, pointCounts = [], []
+
+    tic = time.perf_counter()
+    for image, contour in slices:
+        initialContour = resampleInitialContour(contour, numPoints, spacing)
+        snake, iterations = activeContour(image, initialContour, alpha=alpha, beta=beta, gamma=gamma)
+
+        masks.append(fillContour(snake, image.shape))
+        pointCounts.append(len(initialContour))
+    toc = time.perf_counter()
+
+    return (toc - tic) / len(slices), np.mean(pointCounts), np.array(masks)
+
+
+def main():
+    # Larger slices than the other benchmarks to resemble a large field of view scan
+    fatImage, waterImage = createPhantom((10, 512, 512))
+    slices = [getSliceData(fatImage[slice], waterImage[slice]) for slice in range(fatImage.shape[0])]
+
+    # Run each setting once beforehand so that the cached system inverses do not favor the later settings
+    for numPoints, spacing in settings:
+        runSetting(slices[:1], numPoints, spacing)
+
+    print('Slice shape: %s, %i slices' % (slices[0][0].shape, len(slices)))
+    print('%-12s %-10s %10s %12s %10s' % ('Points', 'Spacing', 'Avg points', 'Sec/slice', 'Dice'))
+
+    referenceMasks = None
+    for numPoints, spacing in settings:
+        timeTaken, pointCount, masks = runSetting(slices, numPoints, spacing)
+
+        # First setting is the unmodified outline and is used as the reference
+        if referenceMasks is None:
+            referenceMasks = masks
+
+        dice = 2 * (masks & referenceMasks).sum() / (masks.sum() + referenceMasks.sum())
+        print('%-12s %-10s %10.1f %12f %10.6f' % (numPoints, spacing, pointCount, timeTaken, dice))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+from benchmarks.phantom import createPhantom
+from util import constants
+from util.util import KMeansWarmStart, kmeans, kmeansExact
+
+# Benchmark of the K-means backends used to segment each slice into fat/water masks
+# The sklearn backend is also timed with each slice warm started from the centroids of the previous slice (see
+# constants.kMeansWarmStart) and compared to the full fit with 10 restarts
+# Run from the root of the repository: python -m benchmarks.benchmarkKMeans
+
+
+def timeBackend(backend, images, warmStart=None):
+    constants.kMeansBackend = backend
+
+    masks = []
+    tic = time.perf_counter()
+    for image in images:
+        labelOrder, centroids, labels = kmeans(image, 2, warmStart=warmStart)
+        masks.append(labels == labelOrder[1])
+    toc = time.perf_counter()
+
+    return (toc - tic) / len(images), np.array(masks)
+
+
+def main():
+    fatImage, waterImage = createPhantom((10, 256, 256))
+    images = list(fatImage) + list(waterImage)
+
+    sklearnTime, sklearnMasks = timeBackend('sklearn', images)
+    exactTime, exactMasks = timeBackend('exact', images)
+
+    # Warm start the slices of the fat and water volumes separately, the same as the segmentation
+    fatWarmStart, waterWarmStart = KMeansWarmStart(), KMeansWarmStart()
+    fatWarmTime, fatWarmMasks = timeBackend('sklearn', images[:len(fatImage)], fatWarmStart)
+    waterWarmTime, waterWarmMasks = timeBackend('sklearn', images[len(fatImage):], waterWarmStart)
+    warmTime = (fatWarmTime + waterWarmTime) / 2
+    warmMasks = np.concatenate([fatWarmMasks, waterWarmMasks])
+
+    # Compare the centroids found by each backend
+    constants.kMeansBackend = 'sklearn'
+    centroidDifference = max(np.abs(np.sort(kmeans(image, 2)[1].ravel()) - kmeansExact(image)[1].ravel()).max()
+                             for image in images)
+
+    print('Slice shape: %s, %i slices' % (images[0].shape, len(images)))
+    print('sklearn: %f seconds per slice' % sklearnTime)
+    print('exact:   %f seconds per slice (%.1fx faster)' % (exactTime, sklearnTime / exactTime))
+    print('Pixels labeled differently: %i of %i' % ((sklearnMasks != exactMasks).sum(), sklearnMasks.size))
+    print('Maximum centroid difference: %g' % centroidDifference)
+    print('sklearn warm started: %f seconds per slice (%.1fx faster)' % (warmTime, sklearnTime / warmTime))
+    print('Pixels labeled differently: %i of %i' % ((sklearnMasks != warmMasks).sum(), sklearnMasks.size))
+    print('Fat: %s' % fatWarmStart)
+    print('Water: %s' % waterWarmStart)
+
+
+if __name__ == '__main__':
+    main()
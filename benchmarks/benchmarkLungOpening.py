@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import scipy.ndimage
+import skimage.morphology
+
+from benchmarks.phantom import createPhantom
+from util.util import binaryOpeningDisk, createBodyMasks, kmeansMasks
+
+# Benchmark of the backends used to open the lung mask of each thoracic slice with a disk of radius 10
+# (constants.lungOpeningBackend). Accuracy is measured against opening with the full disk from scikit-image
+# The disk decomposed into a sequence of smaller footprints by scikit-image is included for comparison
+# Run from the root of the repository: python -m benchmarks.benchmarkLungOpening
+
+radius = 10
+
+
+def getLungMasks(shape):
+    fatImage, waterImage = createPhantom(shape, lungs=True)
+
+    # Lung masks before the opening, same as segmentThoracicSlice
+    slices = range(shape[0])
+    fatImageMasks, fatWarmStart = kmeansMasks(fatImage, 2, slices)
+    waterImageMasks, waterWarmStart = kmeansMasks(waterImage, 2, slices)
+    bodyMasks = createBodyMasks(fatImageMasks, waterImageMasks, slices)
+
+    return bodyMasks & ~fatImageMasks & ~waterImageMasks
+
+
+def timeOpening(opening, lungMasks):
+    tic = time.perf_counter()
+    masks = np.array([opening(lungMask) for lungMask in lungMasks])
+    toc = time.perf_counter()
+
+    return (toc - tic) / len(lungMasks), masks
+
+
+def main():
+    lungMasks = getLungMasks((10, 320, 260))
+
+    methods = [
+        ('skimage', lambda mask: binaryOpeningDisk(mask, radius, 'skimage')),
+        ('distance', lambda mask: binaryOpeningDisk(mask, radius, 'distance')),
+        ('decomposed', lambda mask: skimage.morphology.binary_opening(
+            mask, skimage.morphology.disk(radius, decomposition='sequence'))),
+    ]
+
+    print('Slice shape: %s, %i slices' % (lungMasks.shape[1:], len(lungMasks)))
+    print('%-12s %12s %10s %14s' % ('Backend', 'Sec/slice', 'Dice', 'Pixels differ'))
+
+    referenceTime, referenceMasks = None, None
+    for name, opening in methods:
+        timeTaken, masks = timeOpening(opening, lungMasks)
+
+        # First method is the full disk from scikit-image and is used as the reference
+        if referenceMasks is None:
+            referenceTime, referenceMasks = timeTaken, masks
+
+        dice = 2 * (masks & referenceMasks).sum() / (masks.sum() + referenceMasks.sum())
+        print('%-12s %12f %10.6f %14i (%.1fx faster)' % (name, timeTaken, dice, (masks != referenceMasks).sum(),
+                                                       referenceTime / timeTaken))
+
+    # The lungs should come out of the opening as the two largest objects, see splitLungs
+    lungCounts = [scipy.ndimage.label(mask)[1] for mask in referenceMasks]
+    print('Objects in the opened lung masks: %s' % lungCounts)
+
+
+if __name__ == '__main__':
+    main()
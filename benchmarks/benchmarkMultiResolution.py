@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+
+from benchmarks.benchmarkActiveContour import alpha, beta, gamma, fillContour
+from benchmarks.benchmarkContourResampling import getSliceData
+from benchmarks.phantom import createPhantom
+from util.activeContour import activeContour
+
+# Benchmark of fitting the snake coarse to fine (constants.snakeDownsampleFactor and constants.snakeRefineMaxIterations)
+# Accuracy is measured against the abdominal mask found by fitting the snake at full resolution only
+# Run from the root of the repository: python -m benchmarks.benchmarkMultiResolution
+
+# Settings to compare as (downsample factor, maximum refinement iterations at full resolution)
+settings = [(1, 0), (2, 25), (2, 50), (2, 100), (4, 25), (4, 50), (4, 100)]
+
+# Scale of the initial contour relative to the outline of the body mask
+# A larger initial contour emulates slices where the snake has further to move, e.g. when the arms are not removed
+initialScales = [1.0, 1.2]
+
+
+def runSetting(slices, downsampleFactor, refineMaxIterations):
+    masks, totalIterations = [], 0
+
+    tic = time.perf_counter()
+    for image, contour in slices:
+        snake, iterations = activeContour(image, contour, alpha=alpha, beta=beta, gamma=gamma,
+                                          downsampleFactor=downsampleFactor, refineMaxIterations=refineMaxIterations)
+
+        masks.append(fillContour(snake, image.shape))
+        totalIterations += iterations
+    toc = time.perf_counter()
+
+    return (toc - tic) / len(slices), totalIterations / len(slices), np.array(masks)
+
+
+def main():
+    fatImage, waterImage = createPhantom((10, 512, 512))
+    slices = [getSliceData(fatImage[slice], waterImage[slice]) for slice in range(fatImage.shape[0])]
+
+    print('Slice shape: %s, %i slices' % (slices[0][0].shape, len(slices)))
+
+    for scale in initialScales:
+        # Scale the initial contour about the center of the image
+        center = (np.array(slices[0][0].shape[::-1]) - 1) / 2
+        scaledSlices = [(image, (contour - center) * scale + center) for image, contour in slices]
+
+        print()
+        print('Initial contour scale: %.1f' % scale)
+        print('%-8s %-8s %14s %12s %10s' % ('Factor', 'Refine', 'Avg iterations', 'Sec/slice', 'Dice'))
+
+        referenceMasks = None
+        for downsampleFactor, refineMaxIterations in settings:
+            timeTaken, iterations, masks = runSetting(scaledSlices, downsampleFactor, refineMaxIterations)
+
+            # First setting fits at full resolution only and is used as the reference
+            if referenceMasks is None:
+                referenceMasks = masks
+
+            dice = 2 * (masks & referenceMasks).sum() / (masks.sum() + referenceMasks.sum())
+            print('%-8i %-8i %14.1f %12f %10.6f' % (downsampleFactor, refineMaxIterations, iterations, timeTaken,
+                                                    dice))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import itertools
+import time
+
+import numpy as np
+
+from benchmarks.benchmarkBiasField import createBiasedImage
+from benchmarks.phantom import createPhantom
+from core.biasCorrection import estimateBiasField
+from util import constants
+
+# Benchmark of the settings of the N4 bias field correction (constants.N4Presets). The phantom is multiplied by a smooth
+# synthetic bias field and the bias field found by N4 is compared to it
+# The bias that remains is the standard deviation inside the body of the log of the ratio between the bias field found
+# by N4 and the synthetic bias field. N4 only finds the bias field up to a constant scale, which does not change the
+# standard deviation of the log. The bias that remains before correction is printed for comparison
+# The bias field is brought back to the size of the original image with B-splines, because zooming the shrinked bias
+# field leaves artefacts at the edges of the image that would hide the differences between the settings
+# The presets are benchmarked first followed by a sweep of the shrink factor, number of fitting levels, iterations per
+# level, convergence threshold and control point spacing
+# The sweep takes about half an hour on a single core, most of it with a shrink factor of 2
+# Run from the root of the repository: python -m benchmarks.benchmarkN4
+
+shape = (48, 320, 320)
+
+# Settings swept, each combination is benchmarked
+shrinkFactors = [2, 4]
+levels = [1, 2, 3, 4]
+iterations = [10, 25, 50]
+convergenceThresholds = [0.001, 0.0001]
+controlPointSpacings = [None, 160]
+
+
+def getResidualBias(biasField, trueBiasField, body):
+    return np.log(biasField[body] / trueBiasField[body]).std()
+
+
+def benchmark(image, trueBiasField, body, shrinkFactor, settings):
+    constants.N4Presets['benchmark'] = settings
+    constants.N4Preset = 'benchmark'
+
+    tic = time.perf_counter()
+    biasField = estimateBiasField(image, shrinkFactor, 'benchmark')
+    toc = time.perf_counter()
+
+    return toc - tic, getResidualBias(biasField, trueBiasField, body)
+
+
+def printResult(name, shrinkFactor, settings, totalTime, residualBias):
+    print('%-10s %6i %-20s %12g %10s %10.2f %14.4f' % (name, shrinkFactor, settings['iterations'],
+                                                       settings['convergenceThreshold'],
+                                                       settings['controlPointSpacing'], totalTime, residualBias))
+
+
+def main():
+    # Header is only used for the debug files, which are not written
+    constants.debugBiasCorrection = False
+    constants.nrrdHeaderDict = {'space directions': np.eye(3)}
+    constants.biasFieldUpsampling = 'bspline'
+
+    image = createBiasedImage(shape)
+    fatImage, _ = createPhantom(shape)
+    trueBiasField = image / np.maximum(fatImage, 1e-6)
+    body = fatImage > 0.3
+
+    print('Image shape: %s, bias before correction: %.4f' % (image.shape, np.log(trueBiasField[body]).std()))
+    print('%-10s %6s %-20s %12s %10s %10s %14s' % ('Preset', 'Shrink', 'Iterations', 'Convergence', 'Spacing',
+                                                   'Time (s)', 'Residual bias'))
+
+    presets = dict(constants.N4Presets)
+    for name, settings in presets.items():
+        printResult(name, constants.shrinkFactor, settings,
+                    *benchmark(image, trueBiasField, body, constants.shrinkFactor, settings))
+
+    for shrinkFactor, levelCount, iterationCount, convergenceThreshold, controlPointSpacing in itertools.product(
+            shrinkFactors, levels, iterations, convergenceThresholds, controlPointSpacings):
+        settings = {'iterations': [iterationCount] * levelCount, 'convergenceThreshold': convergenceThreshold,
+                    'controlPointSpacing': controlPointSpacing}
+        printResult('', shrinkFactor, settings, *benchmark(image, trueBiasField, body, shrinkFactor, settings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import concurrent.futures
+import itertools
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.benchmarkBiasField import createBiasField, getPeakMemory
+from benchmarks.phantom import createPhantom
+from util import constants
+
+# Benchmark of cropping the image to the bounding box of the body before N4 (constants.biasCorrectionCrop) on a wide
+# field of view. The phantom is placed in the middle of a field of view twice as wide and tall, filled with noise like
+# the air of a scan, and multiplied by a smooth synthetic bias field
+# Each setting is run in a fresh process so that the peak memory (maximum resident set size, only available on Unix) is
+# not affected by the other settings, see benchmarks/benchmarkBiasField.py. The bias that remains is the standard
+# deviation inside the body of the log of the ratio between the bias field found by N4 and the synthetic bias field,
+# see benchmarks/benchmarkN4.py. The N4 presets are compared because the default spreads its control points over the
+# cropped image, see constants.biasCorrectionCrop
+# Run from the root of the repository: python -m benchmarks.benchmarkN4Crop
+
+bodyShape = (48, 256, 256)
+shape = (48, 512, 512)
+shrinkFactor = 4
+
+
+def createWideImage():
+    fatImage, _ = createPhantom(bodyShape)
+
+    # Place the body in the middle of the field of view
+    offset = [(size - bodySize) // 2 for size, bodySize in zip(shape, bodyShape)]
+    trueImage = np.abs(np.random.RandomState(1).normal(0, 0.03, shape))
+    trueImage[tuple(slice(start, start + size) for start, size in zip(offset, bodyShape))] = fatImage
+
+    return trueImage, trueImage * createBiasField(shape)
+
+
+def estimate(filename, crop, upsampling, preset):
+    # Imported here so that the worker process only loads what it needs
+    from core.biasCorrection import estimateBiasField
+
+    # Header is only used for the debug files, which are not written
+    constants.debugBiasCorrection = False
+    constants.nrrdHeaderDict = {'space directions': np.eye(3)}
+    constants.biasCorrectionCrop = crop
+    constants.biasFieldUpsampling = upsampling
+    constants.N4Preset = preset
+
+    image = np.load(filename)
+    baseline = getPeakMemory()
+
+    tic = time.perf_counter()
+    biasField = estimateBiasField(image, shrinkFactor, 'benchmark')
+    toc = time.perf_counter()
+
+    return toc - tic, getPeakMemory() - baseline, biasField
+
+
+def main():
+    trueImage, image = createWideImage()
+    trueBiasField = createBiasField(shape)
+    body = trueImage > 0.3
+
+    print('Image shape: %s, body shape: %s, shrink factor: %i' % (shape, bodyShape, shrinkFactor))
+    print('%-10s %-10s %6s %10s %18s %14s' % ('Upsampling', 'Preset', 'Crop', 'Time (s)', 'Peak memory (MB)',
+                                              'Residual bias'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'image.npy')
+        np.save(filename, image)
+
+        for upsampling, preset, crop in itertools.product(['zoom', 'bspline'], ['default', 'precise'], [False, True]):
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                future = executor.submit(estimate, filename, crop, upsampling, preset)
+                totalTime, peakMemory, biasField = future.result()
+
+            residualBias = np.log(biasField[body] / trueBiasField[body]).std()
+            print('%-10s %-10s %6s %10.2f %18.1f %14.4f' % (upsampling, preset, crop, totalTime, peakMemory,
+                                                            residualBias))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def createPhantom(shape=(20, 256, 256), seed=0, noise=0.03, lungs=False):
+    """Create a synthetic Dixon fat and water phantom of the torso
+
+    The phantom is an elliptical body made up of a ring of subcutaneous fat surrounding muscle and organs (water) with a
+    few depots of visceral fat. The size of the body varies slowly from slice to slice like a real scan. It is only
+    meant to give the algorithms realistic looking data to run on when benchmarking, not to be anatomically correct.
+
+    Parameters
+    ----------
+    shape : (3,) tuple, optional
+        Shape of the volume in C-order, (slices, rows, columns) (default is (20, 256, 256))
+    seed : int, optional
+        Seed for the random number generator used for the noise (default is 0)
+    noise : float, optional
+        Standard deviation of the Gaussian noise added to the images (default is 0.03)
+    lungs : bool, optional
+        If True, two lungs with no fat or water content are placed on either side of the center of the body like a
+        thoracic slice (default is False)
+
+    Returns
+    -------
+    fatImage : :class:`numpy.ndarray`
+        Fat image with intensities between 0.0 and 1.0
+    waterImage : :class:`numpy.ndarray`
+        Water image with intensities between 0.0 and 1.0
+    """
+
+    random = np.random.RandomState(seed)
+
+    slices, rows, columns = shape
+    y, x = np.mgrid[:rows, :columns]
+    centerY, centerX = rows / 2, columns / 2
+
+    fatImage = np.zeros(shape)
+    waterImage = np.zeros(shape)
+
+    for slice in range(slices):
+        # Radii of the body vary slowly with the slice
+        phase = 2 * np.pi * slice / max(slices, 1)
+        radiusY = rows * (0.30 + 0.02 * np.sin(phase))
+        radiusX = columns * (0.40 + 0.02 * np.cos(phase))
+
+        # Normalized elliptical distance from the center of the body, 1.0 is the skin
+        distance = np.sqrt(((y - centerY) / radiusY) ** 2 + ((x - centerX) / radiusX) ** 2)
+
+        body = distance <= 1.0
+        subcutaneousFat = body & (distance > 0.85)
+        inner = body & ~subcutaneousFat
+
+        # Visceral fat depots placed around the inside of the abdomen
+        visceralFat = np.zeros((rows, columns), bool)
+        for angle in np.linspace(0, 2 * np.pi, 7, endpoint=False) + phase / 4:
+            depotY = centerY + 0.45 * radiusY * np.sin(angle)
+            depotX = centerX + 0.45 * radiusX * np.cos(angle)
+            visceralFat |= ((y - depotY) ** 2 + (x - depotX) ** 2) <= (0.08 * min(rows, columns)) ** 2
+
+        visceralFat &= inner
+
+        # Left and right lung are ellipses on either side of the center of the body, the shape of the lungs varies
+        # slightly with the slice
+        lung = np.zeros((rows, columns), bool)
+        if lungs:
+            for side in (-1, 1):
+                lungY = centerY + 0.15 * radiusY
+                lungX = centerX + side * 0.40 * radiusX
+                lung |= (((y - lungY) / (0.55 * radiusY)) ** 2 +
+                         ((x - lungX) / ((0.28 + 0.03 * side * np.sin(phase)) * radiusX)) ** 2) <= 1.0
+
+            lung &= inner
+            visceralFat &= ~lung
+
+        fatImage[slice][subcutaneousFat | visceralFat] = 0.9
+        fatImage[slice][inner & ~visceralFat] = 0.1
+        waterImage[slice][inner & ~visceralFat] = 0.8
+        fatImage[slice][lung] = 0.0
+        waterImage[slice][lung] = 0.0
+        waterImage[slice][subcutaneousFat | visceralFat] = 0.1
+
+    fatImage += random.normal(0, noise, shape)
+    waterImage += random.normal(0, noise, shape)
+
+    return np.clip(fatImage, 0.0, 1.0), np.clip(waterImage, 0.0, 1.0)
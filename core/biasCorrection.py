@@ -1,3 +1,4 @@
+import concurrent.futures
 import os
 
 import SimpleITK as sitk
@@ -9,6 +10,10 @@ import skimage.filters
 import skimage.transform
 
 from util import constants
+from util import profiling
+from util.cache import Cache, getKey
+from util.parallel import getCoreCount
+from util.util import writeNrrd
 
 
 # Get resulting path for debug files
@@ -16,18 +21,148 @@ def getDebugPath(prefix, filename):
     return os.path.join(constants.pathDir, 'debug', prefix, filename)
 
 
-# Given an image and a shrink factor, the image is corrected via N4 bias correction method
-def correctBias(image, shrinkFactor, prefix):
+# Get the number of threads ITK uses for each N4 bias correction when concurrentImages images are corrected at once
+# If constants.N4Threads is 0, the CPU cores of the subject are split evenly between the images without going over the
+# ITK default, which is the number of CPU cores of the machine unless ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS is set
+def getN4Threads(concurrentImages=1):
+    if constants.N4Threads > 0:
+        return constants.N4Threads
+
+    return max(min(getCoreCount() // concurrentImages, sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()), 1)
+
+
+# Get the settings of the N4 bias field correction preset in constants.N4Preset
+def getN4Settings():
+    return dict(constants.N4Presets[constants.N4Preset])
+
+
+# Create the N4 bias field correction filter for a shrinked image with the settings of the current preset
+# The spacing between the control points is given in pixels of the original image, so the number of control points
+# depends on the size of the shrinked image and the shrink factor
+def createN4Corrector(shrinkedShape, shrinkFactor, threads):
+    settings = getN4Settings()
+
+    corrector = sitk.N4BiasFieldCorrectionImageFilter()
+    corrector.SetMaximumNumberOfIterations(settings['iterations'])
+    corrector.SetConvergenceThreshold(settings['convergenceThreshold'])
+
+    if settings['controlPointSpacing'] is not None:
+        # The B-spline grid spans the shrinked image, which has a spacing of 1. The number of control points is the
+        # number of spans of the grid plus the spline order. ITK orders the axes as (x, y, z), the reverse of NumPy
+        controlPoints = [max(int(np.ceil((size - 1) * shrinkFactor / settings['controlPointSpacing'])), 1) +
+                         corrector.GetSplineOrder() for size in shrinkedShape]
+        corrector.SetNumberOfControlPoints(controlPoints[::-1])
+
+    corrector.SetNumberOfThreads(threads)
+
+    return corrector
+
+
+# Get the settings of the N4 bias field correction that change the result, used for the key of the bias correction
+# cache. The number of control points is found from the size of the images, which is already part of the key
+def getN4Parameters():
+    corrector = sitk.N4BiasFieldCorrectionImageFilter()
+
+    return dict(getN4Settings(),
+                biasFieldFullWidthAtHalfMaximum=corrector.GetBiasFieldFullWidthAtHalfMaximum(),
+                numberOfHistogramBins=corrector.GetNumberOfHistogramBins(),
+                splineOrder=corrector.GetSplineOrder(),
+                wienerFilterNoise=corrector.GetWienerFilterNoise())
+
+
+# Get the bias field found by N4 at the size of the original image from the B-spline fit of the log bias field
+# N4 fits the B-splines over the physical space of the shrinked image, which has a spacing of 1 and origin of 0. The
+# bias field is evaluated on a grid with the size of the original image placed over the same space, with the first and
+# last pixels of each axis on the first and last pixels of the shrinked image like the zoom used to shrink the image
+def getBiasField(corrector, shape, shrinkedShape):
+    # ITK orders the axes as (x, y, z), the reverse of the NumPy arrays
+    spacing = [(shrinkedSize - 1) / (size - 1) if size > 1 else 1.0
+               for size, shrinkedSize in zip(shape, shrinkedShape)]
+
+    # Only the size, spacing, origin and direction of the reference image are used, so the smallest pixel type is used
+    referenceImage = sitk.Image(list(shape[::-1]), sitk.sitkUInt8)
+    referenceImage.SetSpacing(spacing[::-1])
+
+    # The exponential is taken from a view of the log bias field so that only one copy is made at full size
+    logBiasFieldITK = corrector.GetLogBiasFieldAsImage(referenceImage)
+
+    return np.exp(sitk.GetArrayViewFromImage(logBiasFieldITK))
+
+
+# Get the padded bounding box of the Otsu mask of an image as a tuple of slices, one for each axis
+# The mask is found from the image subsampled by the shrink factor, which is enough to find the edges of the body
+# without the cost of the zoom used to shrink the image. None is returned if the mask is empty
+def getCropBox(image, shrinkFactor, padding):
+    subsampledImage = image[::shrinkFactor, ::shrinkFactor, ::shrinkFactor]
+    mask = subsampledImage >= skimage.filters.threshold_otsu(subsampledImage)
+
+    box = scipy.ndimage.find_objects(mask.astype(np.uint8))
+    if not box:
+        return None
+
+    # Convert the bounding box back to pixels of the original image and pad it. The box is kept at least 2 shrink
+    # factors wide along each axis so that the shrinked image has at least 2 pixels along each axis
+    cropBox = []
+    for index, size in zip(box[0], image.shape):
+        start = max(index.start * shrinkFactor - padding, 0)
+        stop = min((index.stop - 1) * shrinkFactor + 1 + padding, size)
+
+        if stop - start < 2 * shrinkFactor:
+            start, stop = 0, size
+
+        cropBox.append(slice(start, stop))
+
+    return tuple(cropBox)
+
+
+# Given an image and a shrink factor, estimate the bias field of the image via N4 bias correction method
+# The bias field is returned at the size of the original image
+# threads is the number of threads used by ITK for N4, by default getN4Threads() is used
+# If constants.biasCorrectionCrop is set, the bias field is only estimated within the bounding box of the body and
+# extended to the rest of the image from the edges of the box
+def estimateBiasField(image, shrinkFactor, prefix, threads=None):
+    if threads is None:
+        threads = getN4Threads()
+
     # If debug bias correction is turned on, then create the directory where the debug files will be saved
     # If the directory already exists then that is okay
     # Save original image
     if constants.debugBiasCorrection:
         os.makedirs(getDebugPath(prefix, ''), exist_ok=True)
-        nrrd.write(getDebugPath(prefix, 'image.nrrd'), image.T, constants.nrrdHeaderDict)
+        writeNrrd(getDebugPath(prefix, 'image.nrrd'), image.T, constants.nrrdHeaderDict)
 
+    cropBox = None
+    if constants.biasCorrectionCrop:
+        with profiling.span('crop'):
+            cropBox = getCropBox(image, shrinkFactor, constants.biasCorrectionCropPadding)
+
+    if cropBox is None:
+        biasField = _estimateBiasField(image, shrinkFactor, prefix, threads)
+    else:
+        croppedImage = image[cropBox]
+        print('Bias correction cropped from %s to %s' % (image.shape, croppedImage.shape))
+
+        biasField = _estimateBiasField(croppedImage, shrinkFactor, prefix, threads)
+
+        # Paste the bias field back into an image of the original size and fill the rest with the bias field at the
+        # nearest edge of the box
+        with profiling.span('uncrop'):
+            biasField = np.pad(biasField, [(index.start, size - index.stop)
+                                           for index, size in zip(cropBox, image.shape)], mode='edge')
+
+    if constants.debugBiasCorrection:
+        writeNrrd(getDebugPath(prefix, 'biasField.nrrd'), biasField.T, constants.nrrdHeaderDict)
+
+    return biasField
+
+
+# Estimate the bias field of the image via N4 bias correction method, see estimateBiasField
+# The debug files of the shrinked image are for the cropped image when the image is cropped
+def _estimateBiasField(image, shrinkFactor, prefix, threads):
     # Shrink image by shrinkFactor to make the bias correction quicker
     # Use resample to linearly interpolate between pixel values
-    shrinkedImage = scipy.ndimage.interpolation.zoom(image, 1 / shrinkFactor)
+    with profiling.span('shrink'):
+        shrinkedImage = scipy.ndimage.interpolation.zoom(image, 1 / shrinkFactor)
 
     # Since the image is shrinked, this means the spacing between pixels increased by the shrink factor
     # Adjust this in the NRRD header
@@ -35,57 +170,204 @@ def correctBias(image, shrinkFactor, prefix):
     nrrdHeaderDictShrinked['space directions'] = nrrdHeaderDictShrinked['space directions'] / shrinkFactor
 
     if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'imageShrinked.nrrd'), shrinkedImage.T, nrrdHeaderDictShrinked)
+        writeNrrd(getDebugPath(prefix, 'imageShrinked.nrrd'), shrinkedImage.T, nrrdHeaderDictShrinked)
 
     # Perform Otsu's thresholding method on images to get a mask for N4 correction bias
     # According to Sled's paper (author of N3 bias correction), the mask is to remove infinity values
     # from log-space (log(0) = infinity)
-    imageMaskThresh = skimage.filters.threshold_otsu(shrinkedImage)
-    imageMask = (shrinkedImage >= imageMaskThresh).astype(np.uint8)
+    with profiling.span('otsu'):
+        imageMaskThresh = skimage.filters.threshold_otsu(shrinkedImage)
+        imageMask = (shrinkedImage >= imageMaskThresh).astype(np.uint8)
 
     if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'imageMask.nrrd'), imageMask.T, nrrdHeaderDictShrinked)
+        writeNrrd(getDebugPath(prefix, 'imageMask.nrrd'), imageMask.T, nrrdHeaderDictShrinked)
 
     # Apply N4 bias field correction to the shrinked image
     shrinkedImageITK = sitk.GetImageFromArray(shrinkedImage)
     imageMaskITK = sitk.GetImageFromArray(imageMask)
-    correctedImageITK = sitk.N4BiasFieldCorrection(shrinkedImageITK, imageMaskITK)
+    corrector = createN4Corrector(shrinkedImage.shape, shrinkFactor, threads)
+    with profiling.stage('N4'):
+        correctedImageITK = corrector.Execute(shrinkedImageITK, imageMaskITK)
     correctedImage = sitk.GetArrayFromImage(correctedImageITK)
 
     if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'correctedImageShrinked.nrrd'), correctedImage.T, nrrdHeaderDictShrinked)
+        writeNrrd(getDebugPath(prefix, 'correctedImageShrinked.nrrd'), correctedImage.T, nrrdHeaderDictShrinked)
 
-    # Replace all 0s in shrinked image with very small number
-    # Prevents infinity values when calculating shrinked bias field, prevents divide by zero issues
-    correctedImage[correctedImage == 0] = 0.001
+    if constants.biasFieldUpsampling == 'bspline':
+        if constants.debugBiasCorrection:
+            biasFieldShrinked = np.exp(sitk.GetArrayFromImage(corrector.GetLogBiasFieldAsImage(shrinkedImageITK)))
+            writeNrrd(getDebugPath(prefix, 'biasFieldShrinked.nrrd'), biasFieldShrinked.T, nrrdHeaderDictShrinked)
 
-    # Get the bias field by dividing measured image by corrected image
-    # v(x) / u(x) = f(x)
-    biasFieldShrinked = shrinkedImage / correctedImage
+        # Evaluate the B-spline bias field from N4 directly at the size of the original image
+        with profiling.span('upsample'):
+            biasField = getBiasField(corrector, image.shape, shrinkedImage.shape)
 
-    if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'biasFieldShrinked.nrrd'), biasFieldShrinked.T, nrrdHeaderDictShrinked)
+            # Clip all values below 0.50 to 0.50. We know the biasField should not be changing items by more than a
+            # factor of two
+            biasField[biasField < 0.50] = 0.50
+    else:
+        # Replace all 0s in shrinked image with very small number
+        # Prevents infinity values when calculating shrinked bias field, prevents divide by zero issues
+        correctedImage[correctedImage == 0] = 0.001
 
-    # TODO This causes the first and last slice of the biasField to be all 0s
-    # Since the image was shrinked when performing bias correction to speed up the process, the bias field is
-    # now expanded to the original image size
-    biasField = scipy.ndimage.interpolation.zoom(biasFieldShrinked, np.array(image.shape) / biasFieldShrinked.shape)
+        # Get the bias field by dividing measured image by corrected image
+        # v(x) / u(x) = f(x)
+        biasFieldShrinked = shrinkedImage / correctedImage
 
-    # Clip all values below 0.50 to 0.50. We know the biasField should not be changing items by more than a factor
-    # of two
-    biasField[biasField < 0.50] = 0.50
+        if constants.debugBiasCorrection:
+            writeNrrd(getDebugPath(prefix, 'biasFieldShrinked.nrrd'), biasFieldShrinked.T, nrrdHeaderDictShrinked)
 
-    if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'biasField.nrrd'), biasField.T, constants.nrrdHeaderDict)
+        # TODO This causes the first and last slice of the biasField to be all 0s
+        # Since the image was shrinked when performing bias correction to speed up the process, the bias field is
+        # now expanded to the original image size
+        with profiling.span('upsample'):
+            biasField = scipy.ndimage.interpolation.zoom(biasFieldShrinked,
+                                                         np.array(image.shape) / biasFieldShrinked.shape)
+
+            # Clip all values below 0.50 to 0.50. We know the biasField should not be changing items by more than a
+            # factor of two
+            biasField[biasField < 0.50] = 0.50
+
+    return biasField
 
+
+# Given an image and its bias field, remove the bias field from the image
+def applyBiasField(image, biasField, prefix):
     # Get the actual image by dividing original image by the bias field
     # u(x) = v(x) / f(x)
-    correctedImage = image / biasField
+    with profiling.span('divide'):
+        correctedImage = image / biasField
 
-    # # Rescale corrected image so it is within bounds [0, 1]
-    correctedImage = skimage.exposure.rescale_intensity(correctedImage, out_range=(0, 1))
+        # # Rescale corrected image so it is within bounds [0, 1]
+        correctedImage = skimage.exposure.rescale_intensity(correctedImage, out_range=(0, 1))
 
     if constants.debugBiasCorrection:
-        nrrd.write(getDebugPath(prefix, 'correctedImage.nrrd'), correctedImage.T, constants.nrrdHeaderDict)
+        os.makedirs(getDebugPath(prefix, ''), exist_ok=True)
+        writeNrrd(getDebugPath(prefix, 'correctedImage.nrrd'), correctedImage.T, constants.nrrdHeaderDict)
 
     return correctedImage
+
+
+# Given an image and a shrink factor, the image is corrected via N4 bias correction method
+# threads is the number of threads used by ITK for N4, by default getN4Threads() is used
+def correctBias(image, shrinkFactor, prefix, threads=None):
+    biasField = estimateBiasField(image, shrinkFactor, prefix, threads)
+
+    return applyBiasField(image, biasField, prefix)
+
+
+# Get the bias correction cache
+# The cache is shared by all subjects and stored in the cache directory of the user (XDG_CACHE_HOME or ~/.cache) unless
+# constants.biasCacheDirectory is set, so constants.biasCacheMaxSize limits the size of the cache as a whole
+def getBiasCache():
+    directory = constants.biasCacheDirectory
+    if directory is None:
+        directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                 'dixonFatSegmentation', 'biasCache')
+
+    return Cache(directory, constants.biasCacheMaxSize)
+
+
+# Correct several images via N4 bias correction method, e.g. the fat and water images of a Dixon scan
+# The corrected images are cached with a key made from the images and all of the parameters that change the result, so
+# the cached images are only reused when the images and bias correction are exactly the same. The cache is skipped if
+# constants.forceBiasCorrection is set
+# See _correctBiasImages for how the images are corrected. The corrected images are returned in the same order as images
+# If filenames is given, each corrected image is also saved to the NRRD file with the same index, see
+# saveCorrectedImages
+def correctBiasImages(images, shrinkFactor, prefixes, sharedPrefix='combinedImageBiasCorrection', filenames=None,
+                      compressionLevel=9):
+    # Number of threads and images corrected at once do not change the result, so they are not included
+    parameters = {
+        'version': 2,
+        'SimpleITK': sitk.Version_VersionString(),
+        'shrinkFactor': shrinkFactor,
+        'biasFieldMode': constants.biasFieldMode if len(images) > 1 else 'separate',
+        'biasFieldUpsampling': constants.biasFieldUpsampling,
+        'biasCorrectionCrop': constants.biasCorrectionCropPadding if constants.biasCorrectionCrop else None,
+        'N4': getN4Parameters(),
+    }
+
+    cache = getBiasCache()
+    with profiling.span('cacheKey'):
+        key = getKey(images, parameters)
+
+    if not constants.forceBiasCorrection:
+        with profiling.span('cacheRead'):
+            correctedImages = cache.get(key)
+
+        if correctedImages is not None:
+            print('Bias correction cache hit (%s)' % key)
+            profiling.count('biasCacheHits')
+
+            if filenames is not None:
+                saveCorrectedImages(correctedImages, filenames, key, compressionLevel, overwrite=False)
+
+            return correctedImages
+
+    print('Bias correction cache miss (%s)' % key)
+    profiling.count('biasCacheMisses')
+
+    correctedImages = _correctBiasImages(images, shrinkFactor, prefixes, sharedPrefix)
+
+    with profiling.span('cacheWrite'):
+        cache.put(key, correctedImages)
+
+    if filenames is not None:
+        saveCorrectedImages(correctedImages, filenames, key, compressionLevel, overwrite=True)
+
+    return correctedImages
+
+
+# Save the corrected images to NRRD files with the cache key in the header
+# Unless overwrite is set, a file is only written if it does not exist or was written for another key, so that a cache
+# hit does not spend time compressing and writing the same images again
+def saveCorrectedImages(images, filenames, key, compressionLevel=9, overwrite=True):
+    header = dict(constants.nrrdHeaderDict or {}, biasCacheKey=key)
+
+    for image, filename in zip(images, filenames):
+        if not overwrite and os.path.exists(filename):
+            try:
+                if nrrd.read_header(filename).get('biasCacheKey') == key:
+                    continue
+            except (OSError, nrrd.NRRDError):
+                # Unreadable file is written again
+                pass
+
+        writeNrrd(filename, image.T, header, compression_level=compressionLevel)
+
+
+# Correct several images via N4 bias correction method without the cache
+# Up to constants.biasCorrectionWorkers images are corrected at once in separate threads. This works because N4, which
+# takes most of the time, releases the GIL. The CPU cores of the subject are split between the images so that the
+# threads of ITK do not oversubscribe the CPU
+# If constants.biasFieldMode is shared, one bias field is estimated from the sum of the images instead and removed from
+# each of the images, the debug files of the bias field are saved with sharedPrefix
+def _correctBiasImages(images, shrinkFactor, prefixes, sharedPrefix='combinedImageBiasCorrection'):
+    if constants.biasFieldMode == 'shared':
+        # The fat and water images of a Dixon scan are acquired with the same receive coils, so they share the same
+        # bias field. Their sum is similar to the in-phase image and has signal everywhere within the body, which gives
+        # N4 a better mask than either image on its own
+        combinedImage = images[0].astype(float)
+        for image in images[1:]:
+            combinedImage += image
+
+        biasField = estimateBiasField(combinedImage, shrinkFactor, sharedPrefix)
+
+        return [applyBiasField(image, biasField, prefix) for image, prefix in zip(images, prefixes)]
+
+    workers = constants.biasCorrectionWorkers
+    if workers <= 0:
+        workers = len(images)
+
+    workers = max(min(workers, len(images)), 1)
+    threads = getN4Threads(workers)
+
+    if workers == 1:
+        return [correctBias(image, shrinkFactor, prefix, threads) for image, prefix in zip(images, prefixes)]
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(correctBias, image, shrinkFactor, prefix, threads)
+                   for image, prefix in zip(images, prefixes)]
+
+        return [future.result() for future in futures]
@@ -9,6 +9,7 @@ import yaml
 from lxml import etree
 
 from util import constants
+from util import profiling
 from util import pydicomext
 from util.enums import ScanFormat
 from util.pydicomext import MethodType
@@ -19,20 +20,25 @@ _data = {}
 
 
 def loadData(dataPath, format, saveCache=True):
-    # Load data from cache if able
-    data = _data.get(dataPath)
-    if data:
-        return data
-
-    # Load the data normally
-    if format == ScanFormat.TexasTechDixon:
-        data = _loadTexasTechDixonData(dataPath)
-    elif format == ScanFormat.WashUUnknown:
-        data = _loadWashUUnknownData(dataPath)
-    elif format == ScanFormat.WashUDixon:
-        data = _loadWashUDixonData(dataPath)
-    else:
-        raise ValueError('Format parameter must be a valid ScanFormat option')
+    # Loading the data is the first step of segmenting a subject, so a new profile is started for the subject here
+    # The time taken by each step is written to timing.json in the subject directory at the end of the segmentation
+    profiling.reset()
+
+    with profiling.stage('load'):
+        # Load data from cache if able
+        data = _data.get(dataPath)
+        if data:
+            return data
+
+        # Load the data normally
+        if format == ScanFormat.TexasTechDixon:
+            data = _loadTexasTechDixonData(dataPath)
+        elif format == ScanFormat.WashUUnknown:
+            data = _loadWashUUnknownData(dataPath)
+        elif format == ScanFormat.WashUDixon:
+            data = _loadWashUDixonData(dataPath)
+        else:
+            raise ValueError('Format parameter must be a valid ScanFormat option')
 
     # Save the data to cache if saveCache is True
     if saveCache:
@@ -274,8 +280,4 @@ def _loadWashUDixonData(dataPath):
         'space origin': fatVolume.origin
     }
 
-    # Retrieve the subject name so we can do hacky stuff on a per-subject basis
-    # TODO Remove me when I remove this hack!
-    constants.subjectName = os.path.splitext(os.path.basename(dataPath))[0]
-
     return fatImage, waterImage, config
@@ -1,17 +1,16 @@
 import os
-import time
 
 import cv2
-import nrrd
 import scipy.io
 import scipy.ndimage.morphology
 import skimage.draw
-import skimage.measure
-import skimage.morphology
-import skimage.segmentation
 
-from core.biasCorrection import correctBias
+from core.biasCorrection import correctBiasImages
 from util import constants
+from util import profiling
+from util.activeContour import SnakeWarmStart, activeContour, resampleInitialContour
+from util.enums import ScanFormat
+from util.parallel import getWorkerCount, mapSlices, splitSlices
 from util.util import *
 
 
@@ -26,22 +25,7 @@ def getPath(path):
 
 
 # noinspection PyUnusedLocal
-def segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask):
-    # Fill holes in the fat image mask and invert it to get the background of fat image
-    # OR the fat background mask and fat image mask and take NOT of mask to get the fat void mask
-    fatBackgroundMask = np.logical_not(scipy.ndimage.morphology.binary_fill_holes(fatImageMask))
-    fatVoidMask = np.logical_or(fatBackgroundMask, fatImageMask)
-    fatVoidMask = np.logical_not(fatVoidMask)
-
-    # Next, remove small objects based on their area
-    # Size is the area threshold of objects to use. This number of pixels must be set in an object for it to stay.
-    # remove_small_objects is more desirable than using a simple binary_opening operation in this case because
-    # binary_opening with a 5x5 disk SE was removing long, skinny objects that were not wide enough to pass the test.
-    # However, their area is larger than smaller objects that I need to remove. So remove_small_objects is better since
-    # it utilizes area. Odd issue where a warning will appear saying that a boolean image should be given. This is a
-    # bug in skimage because I traced it down and the label function is returning odd values
-    fatVoidMask = skimage.morphology.remove_small_objects(fatVoidMask, constants.thresholdAbdominalFatVoidsArea)
-
+def segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, warmStart=None):
     # Use active contours to get the abdominal mask
     # Originally, I attempted this using the convex hull but I was not a huge fan of the results since there were
     # instances where the outline was concave and not convex
@@ -55,10 +39,29 @@ def segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask):
     initialContour = contours[index]
     initialContour = initialContour.reshape(initialContour.shape[::2])
 
+    # Resample the initial contour to the configured number of points or spacing, if any
+    initialContour = resampleInitialContour(initialContour, constants.snakeContourPoints,
+                                            constants.snakeContourSpacing)
+
+    # When warm starting, start from the converged contour of the previous slice instead as long as its shape still
+    # matches the body, see SnakeWarmStart. This typically converges in far fewer iterations than starting from the
+    # outline of the body mask
+    if warmStart is not None:
+        initialContour = warmStart.getInitialContour(initialContour, bodyMask)
+
+    # Fit the active contour to a downsampled image first if configured for this scan format
+    downsampleFactor = constants.snakeDownsampleFactor[ScanFormat.TexasTechDixon]
+
     # Perform active contour snake algorithm to get outline of the abdominal mask
-    snakeContour = skimage.segmentation.active_contour(fatVoidMask.astype(np.uint8) * 255, initialContour, alpha=0.70,
-                                                       beta=0.01, gamma=0.1, max_iterations=2500, max_px_move=1.0,
-                                                       w_line=0.0, w_edge=1.0, convergence=0.1)
+    with profiling.stage('snake', slice):
+        snakeContour, snakeIterations = activeContour(fatVoidMask.astype(np.uint8) * 255, initialContour, alpha=0.70,
+                                                      beta=0.01, gamma=0.1, maxIterations=2500, maxPixelMove=1.0,
+                                                      wLine=0.0, wEdge=1.0, convergence=0.1,
+                                                      downsampleFactor=downsampleFactor,
+                                                      refineMaxIterations=constants.snakeRefineMaxIterations)
+
+    if warmStart is not None:
+        warmStart.update(snakeContour)
 
     # Draw snake contour on abdominalMask variable
     # Two options, polygon fills in the area and polygon_perimeter only draws the perimeter
@@ -70,36 +73,15 @@ def segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask):
 
     # SCAT is all fat outside the abdominal mask
     # VAT is all fat inside the abdominal mask
+    # Small objects are removed from SCAT and VAT for the whole volume afterwards
     SCAT = np.logical_and(np.logical_not(abdominalMask), fatImageMask)
     VAT = np.logical_and(abdominalMask, fatImageMask)
 
-    # Remove objects from SCAT where the area is less than given constant
-    SCAT = skimage.morphology.remove_small_objects(SCAT, constants.minSCATObjectArea)
-
-    # Remove objects from VAT where the area is less than given constant
-    VAT = skimage.morphology.remove_small_objects(VAT, constants.minVATObjectArea)
-
-    return fatVoidMask, abdominalMask, SCAT, VAT
-
-
-def segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, CATAxial, CATPosterior, CATAnterior,
-                         CATInferior, CATSuperior):
-    # Fill holes in the fat image mask and invert it to get the background of fat image
-    # OR the fat background mask and fat image mask and take NOT of mask to get the fat void mask
-    fatBackgroundMask = np.logical_not(scipy.ndimage.morphology.binary_fill_holes(fatImageMask))
-    fatVoidMask = np.logical_or(fatBackgroundMask, fatImageMask)
-    fatVoidMask = np.logical_not(fatVoidMask)
+    return abdominalMask, SCAT, VAT, snakeIterations
 
-    # Next, remove small objects based on their area
-    # Size is the area threshold of objects to use. This number of pixels must be set in an object for it to stay.
-    # remove_small_objects is more desirable than using a simple binary_opening operation in this case because
-    # binary_opening with a 5x5 disk SE was removing long, skinny objects that were not wide enough to pass the test.
-    # However, their area is larger than smaller objects that I need to remove. So remove_small_objects is better since
-    # it utilizes area.
-    # Odd issue where a warning will appear saying that a boolean image should be given. This is a bug in skimage
-    # because I traced it down and the label function is returning odd values
-    fatVoidMask = skimage.morphology.remove_small_objects(fatVoidMask, constants.thresholdThoracicFatVoidsArea)
 
+# noinspection PyUnusedLocal
+def segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, warmStart=None):
     # Use active contours to get the abdominal mask
     # Originally, I attempted this using the convex hull but I was not a huge fan of the results since there were
     # instances where the outline was concave and not convex
@@ -113,10 +95,29 @@ def segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, CATAxial
     initialContour = contours[index]
     initialContour = initialContour.reshape(initialContour.shape[::2])
 
+    # Resample the initial contour to the configured number of points or spacing, if any
+    initialContour = resampleInitialContour(initialContour, constants.snakeContourPoints,
+                                            constants.snakeContourSpacing)
+
+    # When warm starting, start from the converged contour of the previous slice instead as long as its shape still
+    # matches the body, see SnakeWarmStart. This typically converges in far fewer iterations than starting from the
+    # outline of the body mask
+    if warmStart is not None:
+        initialContour = warmStart.getInitialContour(initialContour, bodyMask)
+
+    # Fit the active contour to a downsampled image first if configured for this scan format
+    downsampleFactor = constants.snakeDownsampleFactor[ScanFormat.TexasTechDixon]
+
     # Perform active contour snake algorithm to get outline of the abdominal mask
-    snakeContour = skimage.segmentation.active_contour(fatVoidMask.astype(np.uint8) * 255, initialContour, alpha=0.70,
-                                                       beta=0.01, gamma=0.1, max_iterations=2500, max_px_move=1.0,
-                                                       w_line=0.0, w_edge=5.0, convergence=0.1)
+    with profiling.stage('snake', slice):
+        snakeContour, snakeIterations = activeContour(fatVoidMask.astype(np.uint8) * 255, initialContour, alpha=0.70,
+                                                      beta=0.01, gamma=0.1, maxIterations=2500, maxPixelMove=1.0,
+                                                      wLine=0.0, wEdge=5.0, convergence=0.1,
+                                                      downsampleFactor=downsampleFactor,
+                                                      refineMaxIterations=constants.snakeRefineMaxIterations)
+
+    if warmStart is not None:
+        warmStart.update(snakeContour)
 
     # Draw snake contour on abdominalMask variable
     # Two options, polygon fills in the area and polygon_perimeter only draws the perimeter
@@ -130,66 +131,64 @@ def segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, CATAxial
     # lungMask = bodyMask & ~fatImageMask & ~waterImageMask
     # Next, remove any small objects from the binary image since the lungs will be large
     # Fill any small holes within the lungs to get the full lungs
-    lungMask = np.logical_and(np.logical_and(bodyMask, np.logical_not(fatImageMask)), np.logical_not(waterImageMask))
-    lungMask = skimage.morphology.binary_opening(lungMask, skimage.morphology.disk(10))
-    lungMask = scipy.ndimage.morphology.binary_fill_holes(lungMask)
+    with profiling.stage('lungMask', slice):
+        lungMask = np.logical_and(np.logical_and(bodyMask, np.logical_not(fatImageMask)),
+                                  np.logical_not(waterImageMask))
+        lungMask = binaryOpeningDisk(lungMask, 10)
+        lungMask = scipy.ndimage.morphology.binary_fill_holes(lungMask)
 
     # SCAT is all fat outside the thoracic mask
     # ITAT is all fat inside the thoracic mask
+    # Small objects are removed from SCAT for the whole volume afterwards
+    # CAT is found from the ITAT and lung masks for all of the slices with CAT at once afterwards
     SCAT = np.logical_and(np.logical_not(thoracicMask), fatImageMask)
     ITAT = np.logical_and(thoracicMask, fatImageMask)
-    CAT = np.zeros_like(ITAT, dtype=bool)
 
-    # Remove objects from SCAT where the area is less than given constant
-    SCAT = skimage.morphology.remove_small_objects(SCAT, constants.minSCATObjectArea)
+    return thoracicMask, lungMask, SCAT, ITAT, snakeIterations
 
-    if CATInferior <= slice <= CATSuperior:
-        posterior = int(np.round(np.interp(slice, CATAxial, CATPosterior)))
-        anterior = int(np.round(np.interp(slice, CATAxial, CATAnterior)))
 
-        # Label the objects of lung mask. There should only be two objects, the left and right lung
-        # Get centroid of each object. Left lung is on left side, so centroid should be below half of total coronal
-        # plane size
-        lungMaskLabels = skimage.morphology.label(lungMask)
-        lungProps = skimage.measure.regionprops(lungMaskLabels, cache=True)
+# Segment a single axial slice of the torso given the K-means fat and water masks, body mask and fat void mask of the
+# slice
+# Slices below the diaphragm are segmented as abdominal slices and the rest as thoracic slices
+# warmStart is the SnakeWarmStart of the run of slices when warm starting the active contour, otherwise None
+def segmentSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, diaphragmAxial, warmStart=None):
+    # The time taken by each stage of the slice is returned with the results since this may run in a worker process
+    # The last record is the time taken by the whole slice
+    with profiling.collect() as records, profiling.stage('slice', slice):
+        # bodyMask is the combined fat and water masks with small gaps closed and holes filled, see createBodyMasks
 
-        # Sort lung objects based on area descending, first two largest objects are the left/right lung
-        sortedAreaIndices = sorted(range(len(lungProps)), key=lambda x: lungProps[x].area, reverse=True)
+        # Superior of diaphragm is divider between thoracic and abdominal region
+        # Abdominal slices have no thoracic, lung or ITAT results, these are returned as None
+        if slice < diaphragmAxial:
+            abdominalMask, SCATSlice, VATSlice, snakeIterations = \
+                segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, warmStart)
 
-        # Next, sort the two lungs based on their sagittal centroid coordinate
-        # Smaller sagittal centroid coordinate is the left lung, other is right lung
-        # Label ID is the regionprop index + 1
-        sortedCentroidIndices = sorted(sortedAreaIndices[0:2], key=lambda x: lungProps[x].centroid[0])
-        leftLung = (lungMaskLabels == sortedCentroidIndices[0] + 1)
-        rightLung = (lungMaskLabels == sortedCentroidIndices[1] + 1)
+            thoracicMask, lungMask, ITATSlice = None, None, None
+        else:
+            thoracicMask, lungMask, SCATSlice, ITATSlice, snakeIterations = \
+                segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, warmStart)
 
-        # For the left and right lung, retrieve the outer contour index on a row-by-row basis.
-        # Left lung will be lower index and right-lung will be upper index for ROI of CAT
-        leftIndices = maxargwhere(leftLung, axis=1)
-        rightIndices = minargwhere(rightLung, axis=1)
+            abdominalMask, VATSlice = None, None
 
-        # Only extract the relevant indices from posterior to anterior slices
-        # Any -1 values indicate there was no lung mask located there, so set it to the minimum index value
-        leftIndices = leftIndices[posterior:anterior]
-        rightIndices = rightIndices[posterior:anterior]
+    return bodyMask, abdominalMask, thoracicMask, lungMask, SCATSlice, VATSlice, ITATSlice, snakeIterations, records
 
-        leftIndices[leftIndices == -1] = defaultmin(leftIndices[leftIndices != -1], 0)
-        rightIndices[rightIndices == -1] = rightIndices.max()
 
-        # Create CATMask which is a mask of where fat can be located around the heart
-        # From coronal plane, the upper and lower bounds are determined from user entered points
-        # From sagittal plane, this is calculated based on the lungs going around the heart
-        CATMask = np.zeros_like(ITAT, dtype=bool)
-        for heartSlice, leftIndex, rightIndex in zip(range(posterior, anterior), leftIndices, rightIndices):
-            CATMask[heartSlice, leftIndex:rightIndex] = True
+# Segment a run of consecutive slices in order
+# This is called once for each run of slices, either serially or from a worker process. Runs do not depend on each other
+# so they can be segmented in any order. If constants.snakeWarmStart is set, the active contour of each slice starts
+# from the converged contour of the previous slice in the run. Runs never cross the diaphragm
+def segmentSlices(slices, fatImageMasks, waterImageMasks, bodyMasks, fatVoidMasks, diaphragmAxial):
+    results = []
 
-        # CAT is defined as ITAT inside the CATMask
-        CAT[CATMask] = ITAT[CATMask]
+    # Carries the converged snake of each slice over to the next slice in the run
+    warmStart = SnakeWarmStart() if constants.snakeWarmStart else None
 
-        # Remove objects from CAT where the area is less than given constant
-        CAT = skimage.morphology.remove_small_objects(CAT, constants.minCATObjectArea)
+    for slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask in zip(slices, fatImageMasks, waterImageMasks,
+                                                                          bodyMasks, fatVoidMasks):
+        results.append(segmentSlice(slice, fatImageMask, waterImageMask, bodyMask, fatVoidMask, diaphragmAxial,
+                                    warmStart))
 
-    return fatVoidMask, thoracicMask, lungMask, SCAT, ITAT, CAT
+    return results
 
 
 # Segment depots of adipose tissue given Dixon MRI images
@@ -231,32 +230,62 @@ def runSegmentation(data):
     CATAnterior = CATAnterior[CATAxialSortedInds]
 
     # Perform bias correction on MRI images to remove inhomogeneity
-    # If bias correction has been performed already, then load the saved data
-    tic = time.perf_counter()
-    if not constants.forceBiasCorrection and os.path.exists(getPath('fatImage.nrrd')) and os.path.exists(
-            getPath('waterImage.nrrd')):
-        fatImage, header = nrrd.read(getPath('fatImage.nrrd'))
-        waterImage, header = nrrd.read(getPath('waterImage.nrrd'))
-
-        # Transpose image to get back into C-order indexing
-        fatImage, waterImage = fatImage.T, waterImage.T
-    else:
-        fatImage = correctBias(fatImage, shrinkFactor=constants.shrinkFactor, prefix='fatImageBiasCorrection')
-        waterImage = correctBias(waterImage, shrinkFactor=constants.shrinkFactor, prefix='waterImageBiasCorrection')
-
-        # If bias correction is performed, saved images to speed up algorithm in future runs
-        nrrd.write(getPath('fatImage.nrrd'), fatImage.T, constants.nrrdHeaderDict)
-        nrrd.write(getPath('waterImage.nrrd'), waterImage.T, constants.nrrdHeaderDict)
-
-    toc = time.perf_counter()
-    print('N4ITK bias field correction took %f seconds' % (toc - tic))
+    # If the same images have been bias corrected with the same parameters before, the corrected images are taken from
+    # the bias correction cache
+    with profiling.stage('biasCorrection') as record:
+        # The fat and water images are corrected at once if constants.biasCorrectionWorkers allows it
+        # The bias corrected images are saved next to the results, on a cache hit only if they are not there already
+        fatImage, waterImage = correctBiasImages([fatImage, waterImage], shrinkFactor=constants.shrinkFactor,
+                                                 prefixes=['fatImageBiasCorrection', 'waterImageBiasCorrection'],
+                                                 filenames=[getPath('fatImage.nrrd'), getPath('waterImage.nrrd')])
+
+    print('N4ITK bias field correction took %f seconds' % record['wallTime'])
+
+    slices = range(0, fatImage.shape[0])
+
+    # Segment fat/water images using K-means
+    # This is done for every slice before the rest of the segmentation so that each slice can be warm started from the
+    # previous slice if constants.kMeansWarmStart is set
+    with profiling.stage('kmeans') as record:
+        fatImageMasks, fatWarmStart = kmeansMasks(fatImage, constants.kMeanClusters, slices)
+        waterImageMasks, waterWarmStart = kmeansMasks(waterImage, constants.kMeanClusters, slices)
+
+    print('K-means took %f seconds' % record['wallTime'])
+
+    if constants.kMeansWarmStart:
+        print('K-means warm start for fat image: %s' % fatWarmStart)
+        print('K-means warm start for water image: %s' % waterWarmStart)
+
+    # Algorithm assumes that the skin is a closed contour and fully connects
+    # This is a valid assumption but near the umbilicis, there is a discontinuity
+    # so this draws a line near there to create a closed contour
+    with profiling.stage('bodyMask'):
+        fatImageMasks[umbilicisInferior:umbilicisSuperior + 1, umbilicisCoronal, umbilicisLeft:umbilicisRight] = True
+
+        # Get body mask by combining fat and water masks
+        # Apply some closing to the image mask to connect any small gaps (such as at umbilical cord)
+        # Fill all holes which will create a solid body mask
+        # This is done for the whole volume at once rather than in each slice, the result is the same
+        filledBodyMasks = createBodyMasks(fatImageMasks, waterImageMasks, slices)
+
+    # Fill holes in the fat image mask and remove the fat image mask to get the fat void mask
+    with profiling.stage('fatVoidMask'):
+        fatVoidMasks = createFatVoidMasks(fatImageMasks, slices)
+
+        # Next, remove small objects based on their area
+        # Size is the area threshold of objects to use. This number of pixels must be set in an object for it to stay.
+        # Removing small objects is more desirable than using a simple binary_opening operation in this case because
+        # binary_opening with a 5x5 disk SE was removing long, skinny objects that were not wide enough to pass the
+        # test. However, their area is larger than smaller objects that I need to remove. So removing small objects is
+        # better since it utilizes area. This is done for the whole volume at once, each slice is still treated
+        # separately with a different threshold for the abdominal and thoracic slices
+        fatVoidAreas = np.where(np.arange(fatImage.shape[0]) < diaphragmAxial, constants.thresholdAbdominalFatVoidsArea,
+                                constants.thresholdThoracicFatVoidsArea)
+        fatVoidMasks = removeSmallObjects(fatVoidMasks, fatVoidAreas)
 
     # Create empty arrays that will contain slice-by-slice intermediate images when processing the images
     # These are used to print the entire 3D volume out for debugging afterwards
-    fatImageMasks = np.zeros(fatImage.shape, bool)
-    waterImageMasks = np.zeros(fatImage.shape, bool)
     bodyMasks = np.zeros(fatImage.shape, bool)
-    fatVoidMasks = np.zeros(fatImage.shape, bool)
     abdominalMasks = np.zeros(fatImage.shape, bool)
     thoracicMasks = np.zeros(fatImage.shape, bool)
     lungMasks = np.zeros(fatImage.shape, bool)
@@ -267,65 +296,78 @@ def runSegmentation(data):
     ITAT = np.zeros(fatImage.shape, bool)
     CAT = np.zeros(fatImage.shape, bool)
 
-    for slice in range(0, fatImage.shape[0]):
-        # for slice in range(diaphragmSuperiorSlice, fatImage.shape[0]):
-        tic = time.perf_counter()
-
-        fatImageSlice = fatImage[slice, :, :]
-        waterImageSlice = waterImage[slice, :, :]
-
-        # Segment fat/water images using K-means
-        # labelOrder contains the labels sorted from smallest intensity to greatest
-        # Since our k = 2, we want the higher intensity label at index 1
-        labelOrder, centroids, fatImageLabels = kmeans(fatImageSlice, constants.kMeanClusters)
-        fatImageMask = (fatImageLabels == labelOrder[1])
-        labelOrder, centroids, waterImageLabels = kmeans(waterImageSlice, constants.kMeanClusters)
-        waterImageMask = (waterImageLabels == labelOrder[1])
-
-        # Algorithm assumes that the skin is a closed contour and fully connects
-        # This is a valid assumption but near the umbilicis, there is a discontinuity
-        # so this draws a line near there to create a closed contour
-        if umbilicisInferior <= slice <= umbilicisSuperior:
-            fatImageMask[umbilicisCoronal, umbilicisLeft:umbilicisRight] = True
-
-        # Save fat and water masks for debugging
-        fatImageMasks[slice, :, :] = fatImageMask
-        waterImageMasks[slice, :, :] = waterImageMask
-
-        # Get body mask by combining fat and water masks
-        # Apply some closing to the image mask to connect any small gaps (such as at umbilical cord)
-        # Fill all holes which will create a solid body mask
-        # Remove small objects that are artifacts from segmentation
-        bodyMask = np.logical_or(fatImageMask, waterImageMask)
-        bodyMask = skimage.morphology.binary_closing(bodyMask, skimage.morphology.disk(3))
-        bodyMask = scipy.ndimage.morphology.binary_fill_holes(bodyMask)
-        bodyMasks[slice, :, :] = bodyMask
-
-        # Superior of diaphragm is divider between thoracic and abdominal region
-        if slice < diaphragmAxial:
-            fatVoidMask, abdominalMask, SCATSlice, VATSlice = \
-                segmentAbdomenSlice(slice, fatImageMask, waterImageMask, bodyMask)
-
-            # Save some data for debugging
-            fatVoidMasks[slice, :, :] = fatVoidMask
-            abdominalMasks[slice, :, :] = abdominalMask
-            SCAT[slice, :, :] = SCATSlice
-            VAT[slice, :, :] = VATSlice
-        else:
-            fatVoidMask, thoracicMask, lungMask, SCATSlice, ITATSlice, CATSlice = \
-                segmentThoracicSlice(slice, fatImageMask, waterImageMask, bodyMask, CATAxial, CATPosterior, CATAnterior,
-                                     CATInferior, CATSuperior)
+    # Split the abdominal and thoracic slices into runs that are segmented in order
+    # Each slice is its own run unless the active contour is warm started from the previous slice, then there is one
+    # contiguous run per worker for each region
+    abdominalRuns = splitSlices(range(0, diaphragmAxial), constants.snakeWarmStart)
+    thoracicRuns = splitSlices(range(diaphragmAxial, fatImage.shape[0]), constants.snakeWarmStart)
+    runs = abdominalRuns + thoracicRuns
+
+    # Arguments for segmenting each run
+    runArgs = [(run, fatImageMasks[run.start:run.stop], waterImageMasks[run.start:run.stop],
+                filledBodyMasks[run.start:run.stop], fatVoidMasks[run.start:run.stop], diaphragmAxial)
+               for run in runs]
+
+    # Thoracic slices take considerably longer to segment than abdominal slices (larger morphological opening and
+    # lung mask). Give each run a cost based on its slices so that the thoracic slices are handed out to
+    # the workers first, otherwise the pool finishes with a long tail of thoracic slices on a few workers
+    runCosts = [len(run) * constants.abdominalSliceCost for run in abdominalRuns] + \
+               [len(run) * constants.thoracicSliceCost for run in thoracicRuns]
+
+    # Runs are independent of each other, so they are spread over constants.sliceWorkers processes. The results are
+    # returned in slice order and are identical to segmenting the slices serially
+    totalSnakeIterations = 0
+    for run, runResults in zip(runs, mapSlices(segmentSlices, runArgs, costs=runCosts)):
+        for slice, results in zip(run, runResults):
+            bodyMask, abdominalMask, thoracicMask, lungMask, SCATSlice, VATSlice, ITATSlice, snakeIterations, \
+                records = results
 
             # Save some data for debugging
-            fatVoidMasks[slice, :, :] = fatVoidMask
-            thoracicMasks[slice, :, :] = thoracicMask
-            lungMasks[slice, :, :] = lungMask
+            bodyMasks[slice, :, :] = bodyMask
             SCAT[slice, :, :] = SCATSlice
-            ITAT[slice, :, :] = ITATSlice
-            CAT[slice, :, :] = CATSlice
 
-        toc = time.perf_counter()
-        print('Completed slice %i in %f seconds' % (slice, toc - tic))
+            if slice < diaphragmAxial:
+                abdominalMasks[slice, :, :] = abdominalMask
+                VAT[slice, :, :] = VATSlice
+            else:
+                thoracicMasks[slice, :, :] = thoracicMask
+                lungMasks[slice, :, :] = lungMask
+                ITAT[slice, :, :] = ITATSlice
+
+            # Add the time taken by each stage of the slice to the profile of the subject
+            profiling.getProfiler().extend(records)
+
+            totalSnakeIterations += snakeIterations
+            print('Completed slice %i in %f seconds (%i snake iterations)' % (slice, records[-1]['wallTime'],
+                                                                              snakeIterations))
+
+    print('Active contour took %i iterations in total' % totalSnakeIterations)
+
+    # CAT is only located in the thoracic slices between the inferior and superior CAT bounds
+    # All of these slices are processed at once
+    with profiling.stage('CAT'):
+        CATSlices = range(max(CATInferior, diaphragmAxial), min(CATSuperior + 1, fatImage.shape[0]))
+
+        if len(CATSlices) > 0:
+            # Interpolate the posterior and anterior bounds for all of the slices, round and convert to an integer
+            CATSliceNumbers = np.arange(CATSlices.start, CATSlices.stop)
+            posterior = np.round(np.interp(CATSliceNumbers, CATAxial, CATPosterior)).astype(int)
+            anterior = np.round(np.interp(CATSliceNumbers, CATAxial, CATAnterior)).astype(int)
+
+            # Label the objects of lung mask. There should only be two objects, the left and right lung
+            # Create CATMask which is a mask of where fat can be located around the heart
+            leftLungs, rightLungs = splitLungs(lungMasks[CATSlices.start:CATSlices.stop])
+            CATMasks = createCATMasks(leftLungs, rightLungs, posterior, anterior)
+
+            # CAT is defined as ITAT inside the CATMask
+            CAT[CATSlices.start:CATSlices.stop] = ITAT[CATSlices.start:CATSlices.stop] & CATMasks
+
+    # Remove objects from SCAT, VAT and CAT where the area is less than given constant
+    # This is done for the whole volume at once, each slice is still treated separately
+    with profiling.stage('cleanup'):
+        SCAT = removeSmallObjects(SCAT, constants.minSCATObjectArea)
+        VAT = removeSmallObjects(VAT, constants.minVATObjectArea)
+        CAT = removeSmallObjects(CAT, constants.minCATObjectArea)
 
     # Write out debug variables
     # Note: All Numpy arrays are transposed before being written to NRRD file because the Numpy arrays are in C-order
@@ -336,24 +378,39 @@ def runSegmentation(data):
     # There are different benefits to each method and it's primarily a standard that programming languages pick. MATLAB
     # & Fortran use Fortarn-ordered, while C and Python and other languages use C-order. C-order is used now because it
     # is what is primarily used by many Python libraries, including Numpy.
-    if constants.debug:
-        nrrd.write(getDebugPath('fatImageMask.nrrd'), skimage.img_as_ubyte(fatImageMasks).T, constants.nrrdHeaderDict)
-        nrrd.write(getDebugPath('waterImageMask.nrrd'), skimage.img_as_ubyte(waterImageMasks).T,
-                   constants.nrrdHeaderDict)
-        nrrd.write(getDebugPath('bodyMask.nrrd'), skimage.img_as_ubyte(bodyMasks).T, constants.nrrdHeaderDict)
-
-        nrrd.write(getDebugPath('fatVoidMask.nrrd'), skimage.img_as_ubyte(fatVoidMasks).T, constants.nrrdHeaderDict)
-        nrrd.write(getDebugPath('abdominalMask.nrrd'), skimage.img_as_ubyte(abdominalMasks).T, constants.nrrdHeaderDict)
-
-        nrrd.write(getDebugPath('lungMask.nrrd'), skimage.img_as_ubyte(lungMasks).T, constants.nrrdHeaderDict)
-        nrrd.write(getDebugPath('thoracicMask.nrrd'), skimage.img_as_ubyte(thoracicMasks).T, constants.nrrdHeaderDict)
-
-    # Save the results of adipose tissue segmentation
-    nrrd.write(getPath('SCAT.nrrd'), skimage.img_as_ubyte(SCAT).T, constants.nrrdHeaderDict)
-    nrrd.write(getPath('VAT.nrrd'), skimage.img_as_ubyte(VAT).T, constants.nrrdHeaderDict)
-    nrrd.write(getPath('ITAT.nrrd'), skimage.img_as_ubyte(ITAT).T, constants.nrrdHeaderDict)
-    nrrd.write(getPath('CAT.nrrd'), skimage.img_as_ubyte(CAT).T, constants.nrrdHeaderDict)
-
-    # If desired, save the results in MATLAB
-    if constants.saveMat:
-        scipy.io.savemat(getPath('results.mat'), mdict={'SCAT': SCAT.T, 'VAT': VAT.T, 'ITAT': ITAT.T, 'CAT': CAT.T})
+    with profiling.stage('write'):
+        if constants.debug:
+            writeNrrd(getDebugPath('fatImageMask.nrrd'), skimage.img_as_ubyte(fatImageMasks).T,
+                      constants.nrrdHeaderDict)
+            writeNrrd(getDebugPath('waterImageMask.nrrd'), skimage.img_as_ubyte(waterImageMasks).T,
+                      constants.nrrdHeaderDict)
+            writeNrrd(getDebugPath('bodyMask.nrrd'), skimage.img_as_ubyte(bodyMasks).T, constants.nrrdHeaderDict)
+
+            writeNrrd(getDebugPath('fatVoidMask.nrrd'), skimage.img_as_ubyte(fatVoidMasks).T, constants.nrrdHeaderDict)
+            writeNrrd(getDebugPath('abdominalMask.nrrd'), skimage.img_as_ubyte(abdominalMasks).T,
+                      constants.nrrdHeaderDict)
+
+            writeNrrd(getDebugPath('lungMask.nrrd'), skimage.img_as_ubyte(lungMasks).T, constants.nrrdHeaderDict)
+            writeNrrd(getDebugPath('thoracicMask.nrrd'), skimage.img_as_ubyte(thoracicMasks).T,
+                      constants.nrrdHeaderDict)
+
+        # Save the results of adipose tissue segmentation
+        writeNrrd(getPath('SCAT.nrrd'), skimage.img_as_ubyte(SCAT).T, constants.nrrdHeaderDict)
+        writeNrrd(getPath('VAT.nrrd'), skimage.img_as_ubyte(VAT).T, constants.nrrdHeaderDict)
+        writeNrrd(getPath('ITAT.nrrd'), skimage.img_as_ubyte(ITAT).T, constants.nrrdHeaderDict)
+        writeNrrd(getPath('CAT.nrrd'), skimage.img_as_ubyte(CAT).T, constants.nrrdHeaderDict)
+
+        # If desired, save the results in MATLAB
+        if constants.saveMat:
+            scipy.io.savemat(getPath('results.mat'), mdict={'SCAT': SCAT.T, 'VAT': VAT.T, 'ITAT': ITAT.T, 'CAT': CAT.T})
+
+    # Write the time taken by each stage and slice next to the results
+    profiling.getProfiler().writeReport(getPath('timing.json'), subject=constants.pathDir,
+                                        scanFormat=str(ScanFormat.TexasTechDixon), sliceWorkers=getWorkerCount(),
+                                        kMeansWorkers=getKMeansWorkerCount(constants.kMeanClusters))
+
+    # Write the start and duration of each stage, slice and NRRD write as a trace if tracing is enabled
+    if constants.trace:
+        profiling.getProfiler().writeTrace(getPath('trace.json'), subject=constants.pathDir,
+                                           scanFormat=str(ScanFormat.TexasTechDixon), sliceWorkers=getWorkerCount(),
+                                           kMeansWorkers=getKMeansWorkerCount(constants.kMeanClusters))
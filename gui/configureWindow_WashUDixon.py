@@ -99,6 +99,15 @@ class ConfigureWindow(QDialog, configureWindow_WashUDixon_ui.Ui_ConfigureWindow)
             self.leftArmBounds = []
             self.rightArmBounds = []
 
+        # Each fat void correction is stored as a tuple of (inferior, superior, polygons)
+        fatVoidCorrections = self.config.get('fatVoidCorrections')
+        if fatVoidCorrections:
+            self.fatVoidCorrections = [(x['inferior'], x['superior'], x['polygons']) for x in fatVoidCorrections]
+
+            self.updateFatVoidCorrections()
+        else:
+            self.fatVoidCorrections = []
+
         self.umbilicisInferiorSpinBox.setMaximum(self.fatImage.shape[0] - 1)
         self.umbilicisSuperiorSpinBox.setMaximum(self.fatImage.shape[0] - 1)
         self.umbilicisLeftSpinBox.setMaximum(self.fatImage.shape[2] - 1)
@@ -160,6 +169,20 @@ class ConfigureWindow(QDialog, configureWindow_WashUDixon_ui.Ui_ConfigureWindow)
         self.clickState = 0
         self.clickData = []
 
+    @pyqtSlot(bool)
+    def on_fatVoidCorrectionsRadioButton_toggled(self, checked):
+        # Clear any polygon that was not finished when leaving this mode
+        self.sliceWidget.fatVoidPolygon = None
+        self.sliceWidget.updateFigure()
+
+        if not checked:
+            return
+
+        self.infoLabel.setText('Click on points of polygon to remove from fat void mask, right click to finish polygon. '
+                               'Press delete to remove corrections on the current slice')
+        self.clickState = 0
+        self.clickData = []
+
     @pyqtSlot(int)
     def on_sliceSlider_valueChanged(self, value):
         self.sliceWidget.sliceNumber = value
@@ -237,6 +260,12 @@ class ConfigureWindow(QDialog, configureWindow_WashUDixon_ui.Ui_ConfigureWindow)
             'rightArm': rightArmBoundsDict
         }
 
+        self.config['fatVoidCorrections'] = [{
+            'inferior': x[0],
+            'superior': x[1],
+            'polygons': x[2]
+        } for x in self.fatVoidCorrections]
+
         configFilename = os.path.join(self.dataPath, 'config.yml')
         with open(configFilename, 'w') as fh:
             yaml.dump(self.config, fh, default_flow_style=False)
@@ -288,6 +317,12 @@ class ConfigureWindow(QDialog, configureWindow_WashUDixon_ui.Ui_ConfigureWindow)
             self.viewFatRadioButton.setChecked(True)
         elif event.key == 'w':
             self.viewWaterRadioButton.setChecked(True)
+        elif event.key == 'delete' and self.fatVoidCorrectionsRadioButton.isChecked():
+            # Remove any fat void corrections on the current slice
+            self.fatVoidCorrections = list(filter(lambda x: not (x[0] <= self.sliceWidget.sliceNumber <= x[1]),
+                                                  self.fatVoidCorrections))
+
+            self.updateFatVoidCorrections()
 
     def on_sliceWidget_clicked(self, event):
         self.transformEvent(event)
@@ -396,6 +431,59 @@ class ConfigureWindow(QDialog, configureWindow_WashUDixon_ui.Ui_ConfigureWindow)
                 self.infoLabel.setText('Click on first point of line for left arm')
                 self.clickState = 0
                 self.clickData = []
+        elif self.fatVoidCorrectionsRadioButton.isChecked():
+            # If not clicking inside the image, then do nothing
+            if not event.inaxes:
+                return
+
+            # State machine:
+            # Click on points of the polygon and right click to finish it, then select inferior/superior axial slices
+            if self.clickState == 0:
+                if event.button == 1:
+                    # Append the x/y data. Saves this information when all the points are selected
+                    self.clickData.append([int(event.xdata), int(event.ydata)])
+
+                    # Show the polygon so far, transformed from LPS coordinate system to RAS system
+                    self.sliceWidget.fatVoidPolygon = [(self.transformX(x), self.transformY(y))
+                                                       for x, y in self.clickData]
+                    self.sliceWidget.updateFigure()
+                elif event.button == 3 and len(self.clickData) >= 3:
+                    # Update click state and the text
+                    self.infoLabel.setText('Click inferior (bottom-most) slice you want correction to start at')
+                    self.clickState += 1
+            elif self.clickState == 1:
+                # Append the slice number. Saves this information when all the points are selected
+                self.clickData.append(self.sliceWidget.sliceNumber)
+
+                # Update click state and the text
+                self.infoLabel.setText('Click superior (top-most) slice you want correction to stop at')
+                self.clickState += 1
+            elif self.clickState == 2:
+                # All the data is retrieved, polygon is every entry except for the inferior slice at the end
+                polygon, inferior = self.clickData[:-1], self.clickData[-1]
+                superior = self.sliceWidget.sliceNumber
+
+                # Append new correction, swap the slices if they were clicked in the wrong order
+                self.fatVoidCorrections.append((min(inferior, superior), max(inferior, superior), [polygon]))
+
+                # Update fat void corrections and the slice widget
+                self.sliceWidget.fatVoidPolygon = None
+                self.updateFatVoidCorrections()
+
+                # Update click state and the text
+                self.infoLabel.setText('Click on points of polygon to remove from fat void mask, right click to finish '
+                                       'polygon. Press delete to remove corrections on the current slice')
+                self.clickState = 0
+                self.clickData = []
+
+    def updateFatVoidCorrections(self):
+        # Set the slice widget polygons to the new ones but transformed from LPS coordinate system to RAS system
+        self.sliceWidget.fatVoidCorrections = [(x[0], x[1], [[(self.transformX(p[0]), self.transformY(p[1]))
+                                                               for p in polygon] for polygon in x[2]])
+                                               for x in self.fatVoidCorrections]
+
+        # Update the figure
+        self.sliceWidget.updateFigure()
 
     def updateArmBounds(self):
         # Sort the left/right arm bounds by the slice number (last entry in tuple)
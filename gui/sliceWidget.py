@@ -56,6 +56,8 @@ class SliceWidget(FigureCanvas):
         self.CATLine = None
         self.leftArmBounds = None
         self.rightArmBounds = None
+        self.fatVoidCorrections = None
+        self.fatVoidPolygon = None
 
     def updateFigure(self):
         # Clear the axes
@@ -149,5 +151,17 @@ class SliceWidget(FigureCanvas):
 
             self.axes.plot([x1, x2], [y1, y2], 'g', lw=1.5)
 
+        # Draw the polygons of the fat void corrections at the current slice
+        # Only draw if current slice is between the inferior and superior slice of the correction
+        if self.fatVoidCorrections is not None:
+            for inferior, superior, polygons in self.fatVoidCorrections:
+                if inferior <= self.sliceNumber <= superior:
+                    for polygon in polygons:
+                        self.axes.add_patch(patches.Polygon(polygon, closed=True, fill=False, color='cyan'))
+
+        # Draw the fat void correction polygon that is currently being created
+        if self.fatVoidPolygon is not None and len(self.fatVoidPolygon) > 0:
+            self.axes.plot([x[0] for x in self.fatVoidPolygon], [x[1] for x in self.fatVoidPolygon], 'c.--')
+
         # Draw the figure now
         self.draw()
@@ -0,0 +1,103 @@
+import argparse
+import glob
+import os
+import sys
+
+import yaml
+
+
+# One-off script to move the fat void corrections that used to be hard-coded in the WashU Dixon segmentation into the
+# config.yml of the subjects they belong to, e.g.
+#     python migrateFatVoidCorrections.py /data/MF032*-PRE
+# The corrections are matched to the subjects by the name of the subject directory. Subjects that already have fat void
+# corrections in their config.yml are left as is
+
+# Fat void corrections of each subject, in the format of the fatVoidCorrections key of config.yml
+# These remove the large voids in the mammary glands that caused the abdominal mask of these subjects to be wrong
+legacyFatVoidCorrections = {
+    'MF0322-PRE': [
+        {'inferior': 66, 'superior': 77, 'polygons': [
+            [[228, 74], [171, 44], [174, 59], [219, 89]],
+            [[105, 40], [50, 67], [58, 82], [106, 55]],
+        ]},
+    ],
+    'MF0323-PRE': [
+        {'inferior': 67, 'superior': 79, 'polygons': [
+            [[244, 70], [160, 20], [153, 49], [208, 99]],
+            [[95, 26], [12, 75], [49, 112], [106, 46]],
+        ]},
+        {'inferior': 46, 'superior': 66, 'polygons': [
+            [[242, 79], [160, 14], [143, 34], [220, 110]],
+            [[86, 18], [7, 90], [42, 113], [114, 38]],
+        ]},
+    ],
+    'MF0324-PRE': [
+        {'inferior': 60, 'superior': 79, 'polygons': [
+            [[253, 49], [169, 19], [154, 40], [236, 96]],
+            [[90, 10], [7, 62], [32, 95], [111, 41]],
+        ]},
+    ],
+    'MF0325-PRE': [
+        {'inferior': 63, 'superior': 79, 'polygons': [
+            [[248, 65], [189, 29], [172, 52], [229, 100]],
+            [[75, 41], [19, 76], [47, 100], [96, 55]],
+        ]},
+    ],
+}
+
+
+# Add the legacy fat void corrections to the config.yml of a subject directory
+# Returns a message describing what was done
+def migrateSubject(dataPath):
+    subjectName = os.path.basename(os.path.normpath(dataPath))
+
+    if subjectName not in legacyFatVoidCorrections:
+        return 'No legacy fat void corrections'
+
+    configFilename = os.path.join(dataPath, 'config.yml')
+
+    # Load the configuration file if it exists, otherwise create the config as an empty dictionary
+    if os.path.exists(configFilename):
+        with open(configFilename, 'r') as fh:
+            config = yaml.safe_load(fh) or {}
+    else:
+        config = {}
+
+    if config.get('fatVoidCorrections'):
+        return 'Fat void corrections already in config.yml, skipped'
+
+    config['fatVoidCorrections'] = legacyFatVoidCorrections[subjectName]
+
+    with open(configFilename, 'w') as fh:
+        yaml.dump(config, fh, default_flow_style=False)
+
+    return 'Added %i fat void corrections to config.yml' % len(config['fatVoidCorrections'])
+
+
+def parseArguments(args=None):
+    parser = argparse.ArgumentParser(description='Add the formerly hard-coded fat void corrections to config.yml')
+    parser.add_argument('subjects', nargs='+',
+                        help='Subject directories to migrate, glob patterns such as /data/MF032* are expanded')
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parseArguments(args)
+
+    failed = False
+    for subject in args.subjects:
+        # Sort the glob results so the order of the subjects is predictable
+        for dataPath in sorted(glob.glob(subject)) or [subject]:
+            if not os.path.isdir(dataPath):
+                print('%s: Invalid directory' % dataPath)
+                failed = True
+                continue
+
+            print('%s: %s' % (dataPath, migrateSubject(dataPath)))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
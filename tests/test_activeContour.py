@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+from util.activeContour import SnakeWarmStart, activeContour
+
+
+def createSlice(radius, shape=(256, 256)):
+    # Elliptical body with a ring of subcutaneous fat 15 pixels thick around the abdominal cavity, which is the fat void
+    # the snake is fit to
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    distance = np.hypot((y - shape[0] / 2) / 0.75, x - shape[1] / 2)
+
+    return distance <= radius, distance <= radius - 15
+
+
+def getBodyContour(bodyMask):
+    # Outline of the body found the same way as the segmentation algorithms
+    contours = cv2.findContours(bodyMask.astype(np.uint8), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    return max(contours, key=cv2.contourArea).reshape(-1, 2).astype(float)
+
+
+def segmentSlices(radii, warmStart=None):
+    # Fit the snake to each slice in order with the parameters of the abdominal slices, returns the area of each snake
+    areas = []
+    for radius in radii:
+        bodyMask, fatVoidMask = createSlice(radius)
+        initialContour = getBodyContour(bodyMask)
+
+        if warmStart is not None:
+            initialContour = warmStart.getInitialContour(initialContour, bodyMask)
+
+        snake, iterations = activeContour(fatVoidMask.astype(np.uint8) * 255, initialContour, alpha=0.70, beta=0.01,
+                                          gamma=0.1, maxIterations=2500, maxPixelMove=1.0, wLine=0.0, wEdge=1.0,
+                                          convergence=0.1)
+
+        if warmStart is not None:
+            warmStart.update(snake)
+
+        areas.append(cv2.contourArea(snake.astype(np.float32)))
+
+    return np.array(areas)
+
+
+def test_warmStartFirstSlice():
+    bodyMask, _ = createSlice(100)
+    bodyContour = getBodyContour(bodyMask)
+
+    warmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=1.0)
+
+    assert warmStart.getInitialContour(bodyContour, bodyMask) is bodyContour
+    assert warmStart.coldStarts == 1
+
+
+def test_warmStartSameBody():
+    bodyMask, _ = createSlice(100)
+    bodyContour = getBodyContour(bodyMask)
+    snake = bodyContour * 0.8 + np.array([128, 128]) * 0.2
+
+    warmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=1.0)
+    warmStart.getInitialContour(bodyContour, bodyMask)
+    warmStart.update(snake)
+
+    # Same body as the previous slice, the previous snake is resampled to the number of points of the body outline
+    initialContour = warmStart.getInitialContour(bodyContour, bodyMask)
+
+    assert initialContour is not bodyContour
+    assert initialContour.shape == bodyContour.shape
+    assert warmStart.warmStarts == 1
+
+
+def test_warmStartBodyGrows():
+    bodyMask, _ = createSlice(100)
+    bodyContour = getBodyContour(bodyMask)
+    snake = bodyContour * 0.8 + np.array([128, 128]) * 0.2
+
+    warmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=1.0)
+    warmStart.getInitialContour(bodyContour, bodyMask)
+    warmStart.update(snake)
+
+    # The previous snake lies well inside of the larger body, so every point is inside the body mask, but the snake
+    # cannot grow out to the new abdominal wall
+    largerBodyMask, _ = createSlice(110)
+    largerBodyContour = getBodyContour(largerBodyMask)
+
+    assert warmStart.getInitialContour(largerBodyContour, largerBodyMask) is largerBodyContour
+    assert warmStart.coldStarts == 2
+
+
+def test_warmStartBodyShrinks():
+    bodyMask, _ = createSlice(100)
+    bodyContour = getBodyContour(bodyMask)
+    snake = bodyContour * 0.95 + np.array([128, 128]) * 0.05
+
+    warmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=1.0)
+    warmStart.getInitialContour(bodyContour, bodyMask)
+    warmStart.update(snake)
+
+    smallerBodyMask, _ = createSlice(90)
+    smallerBodyContour = getBodyContour(smallerBodyMask)
+
+    assert warmStart.getInitialContour(smallerBodyContour, smallerBodyMask) is smallerBodyContour
+
+
+def test_warmStartGrowingBodyAcrossSlices():
+    # The body grows by 2 pixels per slice, so a snake started from the previous slice would stay on the old abdominal
+    # wall and contract from there
+    radii = [100 + 2 * slice for slice in range(12)]
+
+    coldAreas = segmentSlices(radii)
+
+    warmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=1.0)
+    warmAreas = segmentSlices(radii, warmStart)
+
+    assert warmStart.coldStarts > 1
+    np.testing.assert_allclose(warmAreas, coldAreas, rtol=0.04)
+
+    # Without the depth test, every slice after the first is warm started and the snake collapses
+    insideOnlyWarmStart = SnakeWarmStart(tolerance=0.05, distanceTolerance=np.inf)
+    insideOnlyAreas = segmentSlices(radii, insideOnlyWarmStart)
+
+    assert insideOnlyWarmStart.coldStarts == 1
+    assert insideOnlyAreas[-1] < 0.5 * coldAreas[-1]
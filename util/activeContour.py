@@ -0,0 +1,362 @@
+import functools
+
+import numpy as np
+import scipy.interpolate
+import scipy.ndimage
+import skimage
+import skimage.filters
+import skimage.transform
+
+from util import constants
+
+
+def activeContour(image, snake, alpha=0.01, beta=0.1, wLine=0, wEdge=1, gamma=0.01, maxPixelMove=1.0,
+                  maxIterations=2500, convergence=0.1, downsampleFactor=1, refineMaxIterations=None, gridGradient=None):
+    """Active contour model (snake) fit to lines or edges of an image
+
+    This is a port of :meth:`skimage.segmentation.active_contour` for periodic (closed) contours using Cartesian (x, y)
+    coordinates, as in scikit-image before v0.16. Unlike scikit-image, it also returns the number of iterations that
+    were run, which is used to measure the effect of the initial contour on the run time.
+
+    Parameters
+    ----------
+    image : (M, N) :class:`numpy.ndarray`
+        Input image
+    snake : (K, 2) :class:`numpy.ndarray`
+        Initial contour coordinates in Cartesian format (x, y)
+    alpha : float, optional
+        Snake length shape parameter, higher values makes snake contract faster (default is 0.01)
+    beta : float, optional
+        Snake smoothness shape parameter, higher values makes snake smoother (default is 0.1)
+    wLine : float, optional
+        Controls attraction to brightness, use negative values to attract toward dark regions (default is 0)
+    wEdge : float, optional
+        Controls attraction to edges, use negative values to repel snake from edges (default is 1)
+    gamma : float, optional
+        Explicit time stepping parameter (default is 0.01)
+    maxPixelMove : float, optional
+        Maximum pixel distance to move per iteration (default is 1.0)
+    maxIterations : int, optional
+        Maximum iterations to optimize snake shape (default is 2500)
+    convergence : float, optional
+        Convergence criteria (default is 0.1)
+    downsampleFactor : int, optional
+        If greater than 1, the snake is first fit to the image downsampled by this factor and then refined at full
+        resolution for at most :obj:`refineMaxIterations` iterations (default is 1, only fit at full resolution)
+    refineMaxIterations : int, optional
+        Maximum iterations at full resolution after fitting the downsampled image (default is None, uses
+        :obj:`constants.snakeRefineMaxIterations`)
+    gridGradient : bool, optional
+        If True, the gradient of the interpolated image energy is evaluated once on the pixel grid and linearly
+        interpolated at the snake points in each iteration. This is cheaper than evaluating the spline derivatives at
+        every point but moves the snake differently on sharp edges, so the results are not the same (default is None,
+        uses :obj:`constants.snakeGridGradient`)
+
+    Returns
+    -------
+    snake : (K, 2) :class:`numpy.ndarray`
+        Optimized snake in Cartesian format (x, y)
+    iterations : int
+        Number of iterations that were run, including the iterations on the downsampled image
+    """
+
+    # Coarse to fine, most of the movement of the snake is done on the downsampled image where each iteration moves up
+    # to downsampleFactor times as far and is cheaper
+    coarseIterations = 0
+    if downsampleFactor > 1:
+        coarseImage = skimage.transform.downscale_local_mean(skimage.img_as_float(image),
+                                                             (downsampleFactor, downsampleFactor))
+
+        # Each downsampled pixel is the mean of a block of pixels, so its center is offset by half of the block
+        # The number of points is reduced by the same factor to keep the spacing between points in pixels the same since
+        # the shape parameters depend on it
+        offset = (downsampleFactor - 1) / 2
+        coarseSnake = resampleContour((snake - offset) / downsampleFactor, max(len(snake) // downsampleFactor, 5))
+        coarseSnake, coarseIterations = activeContour(coarseImage, coarseSnake, alpha, beta, wLine, wEdge, gamma,
+                                                      maxPixelMove, maxIterations, convergence,
+                                                      gridGradient=gridGradient)
+
+        snake = resampleContour(coarseSnake * downsampleFactor + offset, len(snake))
+        maxIterations = constants.snakeRefineMaxIterations if refineMaxIterations is None else refineMaxIterations
+
+    # Number of previous snakes to compare to when checking for convergence
+    convergenceOrder = 10
+
+    image = skimage.img_as_float(image)
+
+    # Find edges using sobel
+    # The border of the edge image is set to the values just inside of it
+    if wEdge != 0:
+        edge = skimage.filters.sobel(image)
+        edge[0, :] = edge[1, :]
+        edge[-1, :] = edge[-2, :]
+        edge[:, 0] = edge[:, 1]
+        edge[:, -1] = edge[:, -2]
+    else:
+        edge = 0
+
+    # Superimpose intensity and edge images
+    image = wLine * image + wEdge * edge
+
+    if gridGradient is None:
+        gridGradient = constants.snakeGridGradient
+
+    # Interpolate for smoothness
+    interpolator = scipy.interpolate.RectBivariateSpline(np.arange(image.shape[1]), np.arange(image.shape[0]),
+                                                         image.T, kx=2, ky=2, s=0)
+
+    # Optionally evaluate the gradient of the interpolated image energy once on the pixel grid, see gridGradient
+    if gridGradient:
+        gridX, gridY = np.arange(image.shape[1]), np.arange(image.shape[0])
+        gradientX = interpolator(gridX, gridY, dx=1)
+        gradientY = interpolator(gridX, gridY, dy=1)
+
+    x, y = snake[:, 0].astype(float), snake[:, 1].astype(float)
+    n = len(x)
+    xSave = np.empty((convergenceOrder, n))
+    ySave = np.empty((convergenceOrder, n))
+
+    # Only one inversion is needed for implicit spline energy minimization
+    inverse = getSystemInverse(n, alpha, beta, gamma)
+
+    # Explicit time stepping for image energy minimization
+    iteration = 0
+    for iteration in range(1, int(maxIterations) + 1):
+        if gridGradient:
+            fx = scipy.ndimage.map_coordinates(gradientX, (x, y), order=1, mode='nearest')
+            fy = scipy.ndimage.map_coordinates(gradientY, (x, y), order=1, mode='nearest')
+        else:
+            fx = interpolator(x, y, dx=1, grid=False)
+            fy = interpolator(x, y, dy=1, grid=False)
+
+        xn = inverse @ (gamma * x + fx)
+        yn = inverse @ (gamma * y + fy)
+
+        # Movements are capped to maxPixelMove per iteration
+        x += maxPixelMove * np.tanh(xn - x)
+        y += maxPixelMove * np.tanh(yn - y)
+
+        # Convergence criteria needs to compare to a number of previous configurations since oscillations can occur
+        j = (iteration - 1) % (convergenceOrder + 1)
+        if j < convergenceOrder:
+            xSave[j, :] = x
+            ySave[j, :] = y
+        else:
+            distance = np.min(np.max(np.abs(xSave - x[None, :]) + np.abs(ySave - y[None, :]), 1))
+            if distance < convergence:
+                break
+
+    return np.array([x, y]).T, coarseIterations + iteration
+
+
+@functools.lru_cache(maxsize=16)
+def getSystemInverse(n, alpha, beta, gamma):
+    """Get the inverse of the system matrix used to minimize the internal energy of a closed snake
+
+    The system matrix only depends on the number of points in the snake and the shape parameters, which are fixed for
+    each pipeline, so the inverse is cached rather than being recomputed for every slice.
+
+    Parameters
+    ----------
+    n : int
+        Number of points in the snake
+    alpha : float
+        Snake length shape parameter
+    beta : float
+        Snake smoothness shape parameter
+    gamma : float
+        Explicit time stepping parameter
+
+    Returns
+    -------
+    (n, n) :class:`numpy.ndarray`
+        Read-only inverse of the system matrix
+    """
+
+    # Build snake shape matrix for Euler equation
+    # a is the second order derivative and b is the fourth order derivative using central differences
+    eye = np.eye(n)
+    a = np.roll(eye, -1, axis=0) + np.roll(eye, -1, axis=1) - 2 * eye
+    b = np.roll(eye, -2, axis=0) + np.roll(eye, -2, axis=1) - 4 * np.roll(eye, -1, axis=0) - \
+        4 * np.roll(eye, -1, axis=1) + 6 * eye
+    A = -alpha * a + beta * b
+
+    inverse = np.linalg.inv(A + gamma * eye)
+
+    # Prevent the cached array from being modified by the caller
+    inverse.flags.writeable = False
+
+    return inverse
+
+
+def resampleContour(contour, numPoints):
+    """Resample a closed contour to a given number of points evenly spaced along its arc length
+
+    Parameters
+    ----------
+    contour : (K, 2) :class:`numpy.ndarray`
+        Coordinates of the closed contour. The last point is connected to the first point
+    numPoints : int
+        Number of points in the resampled contour
+
+    Returns
+    -------
+    (numPoints, 2) :class:`numpy.ndarray`
+        Resampled contour, starting from the first point of :obj:`contour`
+    """
+
+    # Close the contour and get the cumulative arc length at each point
+    closedContour = np.vstack((contour, contour[:1]))
+    arcLength = np.concatenate(([0], np.cumsum(np.linalg.norm(np.diff(closedContour, axis=0), axis=1))))
+
+    # Evenly spaced positions along the contour, excluding the end since it is the same as the start
+    positions = np.linspace(0, arcLength[-1], numPoints, endpoint=False)
+
+    return np.column_stack([np.interp(positions, arcLength, closedContour[:, i]) for i in range(contour.shape[1])])
+
+
+def resampleInitialContour(contour, numPoints=None, spacing=None):
+    """Resample the initial contour of a snake to a fixed number of points or a fixed spacing between points
+
+    The cost of each iteration of the snake grows with the number of points in the contour, which varies from slice to
+    slice for contours found from a mask. If both :obj:`numPoints` and :obj:`spacing` are None, the contour is returned
+    unchanged.
+
+    Parameters
+    ----------
+    contour : (K, 2) :class:`numpy.ndarray`
+        Coordinates of the closed contour
+    numPoints : int, optional
+        Number of points in the resampled contour, takes precedence over :obj:`spacing` (default is None)
+    spacing : float, optional
+        Distance in pixels between points along the resampled contour (default is None)
+
+    Returns
+    -------
+    (N, 2) :class:`numpy.ndarray`
+        Resampled contour
+    """
+
+    if numPoints is None and spacing is None:
+        return contour
+
+    if numPoints is None:
+        perimeter = np.linalg.norm(np.diff(np.vstack((contour, contour[:1])), axis=0), axis=1).sum()
+        numPoints = int(np.ceil(perimeter / spacing))
+
+    # The system matrix of the snake needs at least 5 points since it uses central differences up to 2 points away
+    return resampleContour(contour, max(numPoints, 5))
+
+
+class SnakeWarmStart:
+    """Warm start the active contour of consecutive slices from the converged snake of the previous slice
+
+    Adjacent slices have nearly the same abdominal wall, so the converged snake of one slice is usually a good initial
+    contour for the next one and converges in far fewer iterations than the outline of the body. The outline of the
+    body is used instead for the first slice and whenever the shapes have diverged in either direction:
+
+    * Too many points of the previous snake lie outside of the current body mask, e.g. the body shrank or moved
+    * The mean depth of the points of the previous snake inside the current body mask, i.e. their distance to the
+      outline of the body, differs by more than :obj:`distanceTolerance` pixels from the mean depth of the snake at
+      the last slice that started from the body outline. With the shape parameters used by the segmentation the snake
+      only contracts, so it cannot grow back out to the abdominal wall once the body grows and collapses inward if it
+      starts inside of the wall. Comparing to the last slice that started from the body outline, rather than the
+      previous slice, stops the body from slowly growing over many slices without the snake ever being reset
+
+    Call :meth:`getInitialContour` and then :meth:`update` for each slice of a run of consecutive slices, in order.
+    Keep a separate instance for each run.
+
+    Parameters
+    ----------
+    tolerance : float, optional
+        Largest fraction of points of the previous snake allowed outside of the body mask (default is None, uses
+        :obj:`constants.snakeWarmStartTolerance`)
+    distanceTolerance : float, optional
+        Largest change in pixels of the mean depth of the snake inside the body mask (default is None, uses
+        :obj:`constants.snakeWarmStartDistanceTolerance`)
+    """
+
+    def __init__(self, tolerance=None, distanceTolerance=None):
+        self.tolerance = constants.snakeWarmStartTolerance if tolerance is None else tolerance
+        self.distanceTolerance = constants.snakeWarmStartDistanceTolerance if distanceTolerance is None else \
+            distanceTolerance
+
+        # Converged snake of the last slice, None until the first slice is segmented
+        self.contour = None
+
+        # Mean depth of the snake inside the body mask at the last slice that started from the body outline
+        self.depth = None
+
+        # Distance of each pixel of the current slice to the outline of the body, None if the current slice was warm
+        # started
+        self.bodyDistance = None
+
+        # Number of slices started from the previous snake and from the body outline
+        self.warmStarts = 0
+        self.coldStarts = 0
+
+    def __str__(self):
+        return '%i warm started snakes, %i snakes started from the body outline' % (self.warmStarts, self.coldStarts)
+
+    @staticmethod
+    def getDepth(contour, bodyDistance):
+        # Mean distance of the points of the contour to the outline of the body, points outside of the image are 0
+        return scipy.ndimage.map_coordinates(bodyDistance, (contour[:, 1], contour[:, 0]), order=1, mode='constant',
+                                             cval=0.0).mean()
+
+    def isDiverged(self, bodyMask, bodyDistance):
+        # Round the points to the nearest pixel and check which ones are inside the body mask
+        # Points outside of the image are considered outside of the body mask
+        x, y = np.round(self.contour).astype(int).T
+        inImage = (x >= 0) & (x < bodyMask.shape[1]) & (y >= 0) & (y < bodyMask.shape[0])
+        insideBody = np.zeros(len(x), bool)
+        insideBody[inImage] = bodyMask[y[inImage], x[inImage]]
+
+        if 1.0 - insideBody.mean() > self.tolerance:
+            return True
+
+        return abs(self.getDepth(self.contour, bodyDistance) - self.depth) > self.distanceTolerance
+
+    def getInitialContour(self, bodyContour, bodyMask):
+        """Get the initial contour of the snake for the next slice
+
+        Parameters
+        ----------
+        bodyContour : (K, 2) :class:`numpy.ndarray`
+            Outline of the body of the slice in Cartesian format (x, y)
+        bodyMask : (M, N) :class:`numpy.ndarray`
+            Body mask of the slice
+
+        Returns
+        -------
+        (K, 2) :class:`numpy.ndarray`
+            Previous snake resampled to the number of points of :obj:`bodyContour` or :obj:`bodyContour` itself if
+            the shapes have diverged
+        """
+
+        bodyDistance = scipy.ndimage.distance_transform_edt(bodyMask)
+
+        if self.contour is None or self.isDiverged(bodyMask, bodyDistance):
+            self.bodyDistance = bodyDistance
+            self.coldStarts += 1
+
+            return bodyContour
+
+        self.bodyDistance = None
+        self.warmStarts += 1
+
+        return resampleContour(self.contour, len(bodyContour))
+
+    def update(self, snake):
+        """Store the converged snake of the slice to start the next slice from
+
+        Parameters
+        ----------
+        snake : (K, 2) :class:`numpy.ndarray`
+            Converged snake of the slice in Cartesian format (x, y)
+        """
+
+        self.contour = snake
+
+        if self.bodyDistance is not None:
+            self.depth = self.getDepth(snake, self.bodyDistance)
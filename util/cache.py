@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import uuid
+import zipfile
+
+import numpy as np
+
+
+def getKey(arrays, parameters):
+    """Get a key for a list of arrays and the parameters used to process them
+
+    The key is a hash of the contents, shape and type of each array along with the parameters, so the same key is only
+    given to identical arrays that are processed the same way.
+
+    Parameters
+    ----------
+    arrays : list of :class:`numpy.ndarray`
+        Arrays to get the key for
+    parameters : dict
+        Parameters used to process the arrays, must be JSON serializable
+
+    Returns
+    -------
+    str
+        Hexadecimal key
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(('%s%s' % (array.dtype.str, array.shape)).encode())
+        digest.update(array.data)
+
+    return digest.hexdigest()
+
+
+class Cache:
+    """Cache of lists of arrays on disk addressed by a key, see :meth:`getKey`
+
+    Each entry is stored as a compressed NPZ file named after its key. Entries are written to a temporary file first
+    and then renamed, so the cache directory can be shared by several processes, e.g. when segmenting a cohort with
+    batch.py.
+
+    When the total size of the entries goes over the maximum size, the least recently used entries are removed. The
+    modification time of an entry is updated whenever it is read, so it is used as the time the entry was last used.
+    """
+
+    def __init__(self, directory, maxSize=0):
+        """Create a cache in a directory, the directory is created if it does not exist
+
+        Parameters
+        ----------
+        directory : str
+            Directory to store the entries in
+        maxSize : int, optional
+            Maximum total size of the entries in bytes, 0 means there is no limit (default is 0)
+        """
+
+        self.directory = directory
+        self.maxSize = maxSize
+
+        os.makedirs(directory, exist_ok=True)
+
+    def getPath(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Get the arrays of an entry
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry
+
+        Returns
+        -------
+        list of :class:`numpy.ndarray` or None
+            Arrays of the entry in the order they were stored or None if there is no entry with the key
+        """
+
+        path = self.getPath(key)
+
+        try:
+            with np.load(path) as data:
+                arrays = [data['arr_%i' % index] for index in range(len(data.files))]
+
+            # Mark the entry as recently used
+            os.utime(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # Entry does not exist or was removed by another process while reading it
+            return None
+
+        return arrays
+
+    def put(self, key, arrays):
+        """Store arrays as an entry and remove the least recently used entries if the cache is too large
+
+        Parameters
+        ----------
+        key : str
+            Key of the entry
+        arrays : list of :class:`numpy.ndarray`
+            Arrays to store
+        """
+
+        # Write to a temporary file in the same directory and rename it so that other processes never see a partially
+        # written entry. The file is created with the default permissions so that other users sharing the cache can
+        # read it
+        temporaryPath = os.path.join(self.directory, '%s.%s.tmp' % (key, uuid.uuid4().hex))
+        try:
+            with open(temporaryPath, 'wb') as fh:
+                np.savez_compressed(fh, *arrays)
+
+            os.replace(temporaryPath, self.getPath(key))
+        except BaseException:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+
+            raise
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the total size of the entries is at most the maximum size
+
+        Parameters
+        ----------
+        keep : str, optional
+            Key of an entry that is never removed, e.g. the one that was just stored (default is None)
+        """
+
+        if self.maxSize <= 0:
+            return
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # Remove the oldest entries first
+        entries.sort()
+        totalSize = sum(size for time, size, path in entries)
+
+        for time, size, path in entries:
+            if totalSize <= self.maxSize:
+                break
+
+            if keep is not None and path == self.getPath(keep):
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                # Already removed by another process
+                pass
+
+            totalSize -= size
@@ -1,6 +1,8 @@
 # This file contains all the constants that will not be regularly changed upon runtime
 # It is benficial to developers who want to fine-tune or tweak some parameters to optimize some aspect of the code
 
+from util.enums import ScanFormat
+
 # Name of the application, organization that created the application and current version of the application
 applicationName = 'Dixon Fat Segmentation Algorithm'
 organizationName = 'Southern Illinois University Edwardsville'
@@ -23,9 +25,144 @@ debugBiasCorrection = True
 # 1 - fatUpper took 690s, so total would be approx. 12 * 4 = 2760s ~= 46min
 shrinkFactor = 4
 
+# Settings of the N4 bias field correction for each preset, the preset that is used is set by N4Preset
+# iterations - Maximum number of iterations at each fitting level, the number of fitting levels is the length of the
+#              list. The number of spans of the B-spline grid of the bias field doubles at each level
+# convergenceThreshold - Fitting at a level stops early once the bias field changes by less than this threshold
+# controlPointSpacing - Spacing between the control points of the B-spline grid at the first level in pixels of the
+#                       original image. None uses the ITK default of one span across the whole image (4 control points
+#                       along each axis)
+# default - Default settings of ITK
+# fast - Few iterations on three levels starting from a grid with control points every 160 pixels. Takes about 40% less
+#        time than the default with a shrink factor of 4 and leaves no more bias on the synthetic phantom
+# precise - Same grid as fast with more iterations at each level. Left the least bias on the synthetic phantom of all
+#           the settings benchmarked, the extra iterations give headroom for scans where the fit converges slowly
+# See benchmarks/benchmarkN4.py for the time taken and bias remaining with different settings
+N4Presets = {
+    'default': {'iterations': [50, 50, 50, 50], 'convergenceThreshold': 0.001, 'controlPointSpacing': None},
+    'fast': {'iterations': [10, 10, 10], 'convergenceThreshold': 0.001, 'controlPointSpacing': 160},
+    'precise': {'iterations': [50, 50, 50], 'convergenceThreshold': 0.001, 'controlPointSpacing': 160},
+}
+N4Preset = 'default'
+
+# Method used to bring the bias field found by N4 on the shrinked image back to the size of the original image
+# zoom - The bias field is found by dividing the shrinked image by the corrected image and zoomed with scipy. Pixels
+#        where the corrected image is 0 have a bias field of 0 before zooming, which is then clipped to 0.50
+# bspline - The B-spline fit of the bias field from N4 is evaluated directly at the size of the original image. Faster
+#           and uses less memory than zoom and gives a smooth bias field everywhere, including outside of the mask and
+#           the first and last slices, see benchmarks/benchmarkBiasField.py
+biasFieldUpsampling = 'zoom'
+
+# Method used to estimate the bias field of the fat and water images of Dixon scans
+# separate - N4 bias correction is performed on the fat and water images separately
+# shared - One bias field is estimated from the sum of the fat and water images with N4 and removed from both images.
+#          Both images share the same receive coil inhomogeneity, so this halves the time of the bias correction
+biasFieldMode = 'separate'
+
+# If True, each image is cropped to the bounding box of its Otsu mask before the bias field is estimated, so that N4
+# does not spend time and memory on the air outside of the body. The bounding box is found from the image subsampled by
+# the shrink factor and padded by biasCorrectionCropPadding pixels of the original image on each side. The bias field
+# outside of the bounding box is the bias field at the nearest edge of the box
+# N4 fits the bias field over the cropped image, so the result is slightly different. With the default N4 preset the
+# control points are spread over the cropped image instead of the whole image, a preset with a controlPointSpacing
+# keeps the B-spline grid the same size and the result closer. Best used with the bspline upsampling, because zooming
+# leaves artefacts at the edges of the bias field that are then copied outward, see benchmarks/benchmarkN4Crop.py
+biasCorrectionCrop = False
+biasCorrectionCropPadding = 32
+
+# Number of images to bias correct at once, e.g. the fat and water images of a Dixon scan with the separate bias field
+# mode
+# N4 releases the GIL, so the images are corrected in threads of the current process. 1 corrects the images one after
+# the other, 0 corrects all of the images at once. Each image being corrected at once needs its own copy of the working
+# memory of the bias correction
+biasCorrectionWorkers = 1
+
+# Number of threads ITK uses for each N4 bias field correction
+# 0 splits the CPU cores of the subject (see subjectCores) evenly between the images being corrected at once without
+# going over the ITK default. The result of N4 does not depend on the number of threads
+N4Threads = 0
+
 # Number of clusters for the K-means algorithm for segmenting images
 kMeanClusters = 2
 
+# Method used to perform K-means clustering on each slice
+# sklearn - Lloyd's algorithm from scikit-learn using k-means++ initialization with 10 restarts
+# exact - Exact solution found from the sorted intensities. Only used when clustering scalar images into 2 clusters,
+#         sklearn is used otherwise. Several times faster, see benchmarks/benchmarkKMeans.py
+kMeansBackend = 'sklearn'
+
+# Whether to start the K-means clustering of each slice from the centroids of the previous slice
+# Adjacent slices have nearly the same intensity distribution, so this only needs a few iterations per slice. A full fit
+# is performed if the warm started run does not converge within kMeansWarmStartMaxIterations iterations or any of the
+# centroids move more than kMeansWarmStartTolerance (intensities are between 0.0 and 1.0)
+# Has no effect with the exact K-means backend
+kMeansWarmStart = False
+kMeansWarmStartTolerance = 0.05
+kMeansWarmStartMaxIterations = 20
+
+# Method used to perform the morphological opening of the lung mask with a disk of radius 10 in each thoracic slice
+# skimage - Binary opening from scikit-image with the full disk
+# distance - Opening found from Euclidean distance transforms. Gives the same result as skimage but is several times
+#            faster, see benchmarks/benchmarkLungOpening.py
+lungOpeningBackend = 'skimage'
+
+# Number of CPU cores available to each subject, shared by the N4 threads and the slice workers
+# 0 uses all of the available CPU cores. batch.py sets this when segmenting several subjects at once so that the
+# subjects do not oversubscribe the CPU
+subjectCores = 0
+
+# Number of worker processes used to segment the slices of a volume in parallel
+# 1 segments the slices serially in the current process, 0 uses one worker per CPU core of the subject (see
+# subjectCores)
+sliceWorkers = 1
+
+# Relative cost of segmenting an abdominal and thoracic slice
+# Used to schedule the slices on the worker processes so that the expensive thoracic slices are started first. Only the
+# ratio between the two values matters
+abdominalSliceCost = 1.0
+thoracicSliceCost = 3.0
+
+# Number of points or spacing in pixels between points to resample the initial contour of the active contour to
+# The number of points in the outline of the body mask varies from slice to slice and the cost of the active contour
+# grows with the number of points. Fewer points is faster but follows the abdominal wall less closely
+# The shape parameters of the active contour act on the distance between neighboring points, so the spacing should stay
+# close to that of the body mask outline (roughly 2-4 pixels). Much sparser contours collapse and much denser contours
+# barely move from the outline, see benchmarks/benchmarkContourResampling.py
+# If snakeContourPoints is set, it takes precedence over snakeContourSpacing. If both are None, the outline of the body
+# mask is used as is
+snakeContourPoints = None
+snakeContourSpacing = None
+
+# Factor to downsample the fat void image by for each scan format when fitting the active contour
+# The active contour is first fit to the downsampled image and then refined at full resolution for at most
+# snakeRefineMaxIterations iterations. 1 fits the active contour at full resolution only
+# A factor of 2 is faster with an abdominal mask that is close to the full resolution one (Dice around 0.99), 4 is
+# faster still but noticeably less accurate, see benchmarks/benchmarkMultiResolution.py
+snakeDownsampleFactor = {
+    ScanFormat.TexasTechDixon: 1,
+    ScanFormat.WashUUnknown: 1,
+    ScanFormat.WashUDixon: 1,
+}
+snakeRefineMaxIterations = 50
+
+# Whether the active contour evaluates the gradient of the edge image once on the pixel grid and linearly interpolates
+# it at the snake points, instead of evaluating the spline derivatives at the snake points in every iteration. Faster,
+# but the snake settles differently on the sharp edges of the fat void mask, so the results change, see
+# benchmarks/benchmarkActiveContour.py
+snakeGridGradient = False
+
+# Whether to start the active contour of each slice from the converged contour of the previous slice
+# The previous contour is only used if no more than snakeWarmStartTolerance of its points lie outside of the body mask
+# of the current slice and the mean distance of its points to the outline of the current body is within
+# snakeWarmStartDistanceTolerance pixels of that of the snake at the last slice that started from the body outline,
+# otherwise the outline of the body mask is used as usual. The snake only contracts, so the distance test catches a body
+# that grows away from the previous contour
+# When running the slices in parallel, the slices are split into one contiguous run per worker and only the first slice
+# of each run starts from the body mask outline
+snakeWarmStart = False
+snakeWarmStartTolerance = 0.05
+snakeWarmStartDistanceTolerance = 1.0
+
 # Threshold area for the fat voids mask in abdominal region. This is used to remove objects smaller than this
 # threshold when determining the fat voids area.
 thresholdAbdominalFatVoidsArea = 30
@@ -49,9 +186,29 @@ minVATObjectArea = 5
 # Boolean option to save final results in MATLAB .mat file
 saveMat = False
 
+# Whether to write a trace of the segmentation to trace.json in the directory of the subject
+# The trace contains the start and duration of each stage, slice and NRRD write along with the process it ran in, which
+# shows how the stages overlap when the slices are segmented in parallel. The file is in the Chrome trace event format,
+# open it in chrome://tracing or https://ui.perfetto.dev
+trace = False
+
 # Constant variables that are set in another function
 pathDir = None
 nrrdHeaderDict = None
 
 # Whether or not to force regeneration of the bias corrected images
-forceBiasCorrection = False
\ No newline at end of file
+# The bias corrected images are otherwise taken from the bias correction cache if the images and all of the parameters
+# of the bias correction are the same
+forceBiasCorrection = False
+
+# Directory of the bias correction cache, None uses dixonFatSegmentation/biasCache in the cache directory of the user
+# (XDG_CACHE_HOME or ~/.cache)
+# The cache is keyed by the contents of the images, so a single directory is shared by all subjects. Set it to a
+# directory on a shared file system to share the cache between the machines of a cluster, see --bias-cache-dir of
+# batch.py
+biasCacheDirectory = None
+
+# Maximum total size of the bias correction cache in bytes, 0 means there is no limit
+# The limit applies to the whole cache directory, not to each subject. The least recently used entries are removed when
+# the cache grows past this size. Entries are stored compressed
+biasCacheMaxSize = 4 * 1024 ** 3
\ No newline at end of file
@@ -41,6 +41,57 @@ def binaryLine(startPoint, endPoint, shape, thickness=1, lineType=cv2.LINE_4):
     return binaryImage
 
 
+def binaryLineCoordinates(startPoint, endPoint, shape, thickness=1, lineType=cv2.LINE_4):
+    """Get the coordinates of the pixels of a binary line drawn from one point to another
+
+    This gives the same pixels as :meth:`binaryLine` but the line is drawn on a small image that only covers the line
+    rather than an image of the given shape, which is much cheaper for short lines on large images.
+
+    Parameters
+    ----------
+    startPoint : (2,) tuple or list or :class:`numpy.ndarray`
+        Starting point to begin drawing line from in Cartesian coordinates (x, y)
+    endPoint : (2,) tuple or list or :class:`numpy.ndarray`
+        Ending point to end drawing line from in Cartesian coordinates (x, y)
+    shape : (N,) tuple or list
+        Shape of the image the line is drawn on in C-order, meaning (height, width) format
+    thickness : int, optional
+        Thickness of the line to draw, see OpenCV :meth:`cv2.line` function for more info (default is 1)
+    lineType : int, optional
+        Type of the line to draw, see OpenCV :meth:`cv2.line` function for more info (default is cv2.LINE_4 which is a
+        4-connected line)
+
+        Valid options are: cv2.LINE_4, cv2.LINE_8, cv2.LINE_AA
+
+    Returns
+    -------
+    rows : (K,) :class:`numpy.ndarray`
+        Row (y) coordinates of the pixels of the line
+    columns : (K,) :class:`numpy.ndarray`
+        Column (x) coordinates of the pixels of the line
+    """
+
+    (x1, y1), (x2, y2) = startPoint, endPoint
+
+    # Small image that covers the line with a border large enough for its thickness
+    border = thickness + 1
+    left, top = min(x1, x2) - border, min(y1, y2) - border
+    right, bottom = max(x1, x2) + border, max(y1, y2) + border
+
+    # OpenCV clips the line to the image before drawing it, which changes the pixels of thick lines that are clipped
+    # Thus, the small image is only used when it fits entirely inside of the image, otherwise the whole image is used
+    if left < 0 or top < 0 or right >= shape[1] or bottom >= shape[0]:
+        return np.nonzero(binaryLine(startPoint, endPoint, shape, thickness, lineType))
+
+    # The line is drawn relative to the top-left corner of the small image
+    localImage = binaryLine((x1 - left, y1 - top), (x2 - left, y2 - top), (bottom - top + 1, right - left + 1),
+                            thickness, lineType)
+
+    rows, columns = np.nonzero(localImage)
+
+    return rows + top, columns + left
+
+
 def binaryRectangle(startPoint, endPoint, shape, thickness=cv2.FILLED, lineType=cv2.LINE_4):
     """Create an image of a given shape with a binary rectangle drawn between two given corners
 
@@ -0,0 +1,136 @@
+import concurrent.futures
+import os
+
+from util import constants
+
+
+def _initializeWorker(state):
+    # Copy the constants from the parent process into the worker process
+    # Runtime values such as pathDir and nrrdHeaderDict are set while loading the data, so they will not be present
+    # when the worker process is spawned rather than forked (e.g. on Windows)
+    for name, value in state.items():
+        setattr(constants, name, value)
+
+
+def getCoreCount():
+    """Get the number of CPU cores available to the current subject
+
+    Returns
+    -------
+    int
+        :obj:`constants.subjectCores` if it is set, otherwise the number of available CPU cores, always at least 1
+    """
+
+    if constants.subjectCores > 0:
+        return constants.subjectCores
+
+    return os.cpu_count() or 1
+
+
+def getWorkerCount(workers=None):
+    """Get the number of worker processes to use for processing slices
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of workers to use. If None, then :obj:`constants.sliceWorkers` is used. A value of 0 or less means use
+        all of the CPU cores available to the subject, see :meth:`getCoreCount`
+
+    Returns
+    -------
+    int
+        Number of worker processes, always at least 1
+    """
+
+    if workers is None:
+        workers = constants.sliceWorkers
+
+    if workers <= 0:
+        workers = getCoreCount()
+
+    return workers
+
+
+def splitSlices(slices, contiguous=False, workers=None):
+    """Split slices into runs that are each segmented in order by a single worker
+
+    Parameters
+    ----------
+    slices : range
+        Slices to split, must have a step of 1
+    contiguous : bool, optional
+        If True, the slices are split into one contiguous run per worker so that each slice can start from the result
+        of the previous slice in the run. Otherwise, each slice is its own run (default is False)
+    workers : int, optional
+        Number of worker processes, see :meth:`getWorkerCount` (default is None, uses :obj:`constants.sliceWorkers`)
+
+    Returns
+    -------
+    list of range
+        Runs of slices in order
+    """
+
+    if not contiguous:
+        return [range(slice, slice + 1) for slice in slices]
+
+    count = min(getWorkerCount(workers), len(slices))
+
+    return [range(slices.start + len(slices) * i // count, slices.start + len(slices) * (i + 1) // count)
+            for i in range(count)]
+
+
+def mapSlices(func, argsList, workers=None, costs=None):
+    """Apply a function to a list of arguments, optionally spreading the calls over a pool of worker processes
+
+    Results are yielded in the same order as :obj:`argsList` regardless of the order the workers complete them in.
+    When only one worker is requested, the calls are made serially in the current process without creating a pool.
+
+    If the calls have noticeably different run times, :obj:`costs` can be given to hand out the most expensive calls
+    first. Otherwise an expensive call submitted last can leave one worker running long after the rest are idle.
+
+    Parameters
+    ----------
+    func : callable
+        Function to call for each set of arguments. Must be defined at the module level so that it can be pickled
+    argsList : iterable of tuple
+        Positional arguments to call :obj:`func` with
+    workers : int, optional
+        Number of worker processes, see :meth:`getWorkerCount` (default is None, uses :obj:`constants.sliceWorkers`)
+    costs : list of float, optional
+        Relative cost of each call in :obj:`argsList`. Calls are submitted to the pool from highest to lowest cost,
+        calls with equal cost keep their original order. Ignored when running serially (default is None, calls are
+        submitted in order)
+
+    Returns
+    -------
+    generator
+        Yields the result of each call to :obj:`func` in the order of :obj:`argsList`
+    """
+
+    workers = getWorkerCount(workers)
+
+    if workers == 1:
+        for args in argsList:
+            yield func(*args)
+
+        return
+
+    # Public values from the constants module are passed to each worker when it is started
+    state = {name: value for name, value in vars(constants).items() if not name.startswith('_')}
+
+    argsList = list(argsList)
+
+    # Order to submit the calls in, the pool starts the calls in the order they are submitted
+    if costs is None:
+        submitOrder = range(len(argsList))
+    else:
+        submitOrder = sorted(range(len(argsList)), key=lambda index: costs[index], reverse=True)
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_initializeWorker,
+                                                initargs=(state,)) as executor:
+        futures = [None] * len(argsList)
+        for index in submitOrder:
+            futures[index] = executor.submit(func, *argsList[index])
+
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,314 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from util import constants
+
+# Context manager returned by spans when tracing is disabled, does nothing
+_nullSpan = contextlib.nullcontext()
+
+
+class Profiler:
+    """Record the wall time and CPU time of named stages of the segmentation
+
+    Each stage is recorded as a dictionary with the name of the stage, the slice it belongs to (None for stages of the
+    whole volume), the wall time and the CPU time in seconds. The CPU time is the time of the process the stage ran in,
+    which is a worker process for slices that are segmented in parallel.
+
+    Stages can be nested, e.g. N4 is part of bias correction, so the times of all stages do not add up to the total.
+
+    If :obj:`constants.trace` is set, each record also contains the time it started along with the process and thread
+    it ran in, so that the stages can be written as a Chrome trace with :meth:`writeTrace`. Spans are finer-grained
+    steps that are only recorded when tracing and are left out of the summary and report.
+    """
+
+    def __init__(self):
+        self.records = []
+
+        # Number of times events occurred, e.g. cache hits, by name of the event
+        self.counters = {}
+
+        # Start of the profile, used for the elapsed time of the report
+        self.startWallTime = time.perf_counter()
+        self.startCPUTime = time.process_time()
+
+    @contextlib.contextmanager
+    def _record(self, name, slice, span):
+        record = {'stage': name, 'slice': slice, 'wallTime': None, 'cpuTime': None}
+        wallTic, cpuTic = time.perf_counter(), time.process_time()
+
+        if constants.trace:
+            # perf_counter is a system-wide monotonic clock, so the start times of records from worker processes line
+            # up with the parent process
+            record.update(start=wallTic, pid=os.getpid(), tid=threading.get_ident(), span=span)
+
+        try:
+            yield record
+        finally:
+            record['wallTime'] = time.perf_counter() - wallTic
+            record['cpuTime'] = time.process_time() - cpuTic
+            self.records.append(record)
+
+    def stage(self, name, slice=None):
+        """Record the time taken by the body of a with statement as a stage
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        slice : int, optional
+            Slice the stage belongs to (default is None, stage is for the whole volume)
+
+        Returns
+        -------
+        context manager
+            Yields the record of the stage, the wall and CPU time are filled in when the with statement exits
+        """
+
+        return self._record(name, slice, False)
+
+    def span(self, name, slice=None):
+        """Record the time taken by the body of a with statement as a span of the trace
+
+        Nothing is recorded unless :obj:`constants.trace` is set, so spans can be placed around small steps without
+        slowing down normal runs.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span
+        slice : int, optional
+            Slice the span belongs to (default is None, span is for the whole volume)
+
+        Returns
+        -------
+        context manager
+            Yields the record of the span or None if tracing is disabled
+        """
+
+        if not constants.trace:
+            return _nullSpan
+
+        return self._record(name, slice, True)
+
+    def count(self, name, value=1):
+        """Increment the number of times an event occurred, the counts are included in the report
+
+        Parameters
+        ----------
+        name : str
+            Name of the event
+        value : int, optional
+            Amount to increment the count by (default is 1)
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def extend(self, records):
+        """Add records from another profiler, e.g. records of a slice returned from a worker process
+
+        Parameters
+        ----------
+        records : list of dict
+            Records to add
+        """
+
+        self.records.extend(records)
+
+    def _stageRecords(self):
+        return (record for record in self.records if not record.get('span'))
+
+    def summary(self):
+        """Get the number of times each stage was recorded and its total wall and CPU time
+
+        Returns
+        -------
+        dict
+            Summary of each stage in the order the stages were first recorded
+        """
+
+        stages = {}
+        for record in self._stageRecords():
+            stage = stages.setdefault(record['stage'], {'count': 0, 'wallTime': 0.0, 'cpuTime': 0.0})
+            stage['count'] += 1
+            stage['wallTime'] += record['wallTime']
+            stage['cpuTime'] += record['cpuTime']
+
+        return stages
+
+    def report(self, **info):
+        """Get a machine-readable report of the profile
+
+        Parameters
+        ----------
+        **info
+            Additional information to include at the top of the report, e.g. the subject and scan format
+
+        Returns
+        -------
+        dict
+            Report containing the additional information, the elapsed wall and CPU time since the profile started, the
+            summary of each stage, the counts of events and the time of each stage of each slice
+        """
+
+        # Group the stages of each slice together, sorted by slice
+        slices = {}
+        for record in self._stageRecords():
+            if record['slice'] is not None:
+                slices.setdefault(record['slice'], {})[record['stage']] = {'wallTime': record['wallTime'],
+                                                                           'cpuTime': record['cpuTime']}
+
+        return dict(info,
+                    elapsedWallTime=time.perf_counter() - self.startWallTime,
+                    elapsedCPUTime=time.process_time() - self.startCPUTime,
+                    stages=self.summary(),
+                    counters=self.counters,
+                    slices=[{'slice': slice, 'stages': slices[slice]} for slice in sorted(slices)])
+
+    def writeReport(self, filename, **info):
+        """Write the report of the profile to a JSON file, see :meth:`report`
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the JSON file to write
+        **info
+            Additional information to include at the top of the report
+        """
+
+        with open(filename, 'w') as fh:
+            json.dump(self.report(**info), fh, indent=2)
+
+    def trace(self, **info):
+        """Get the stages and spans as a Chrome trace
+
+        Only records made while :obj:`constants.trace` was set are included. Each record is a complete event with the
+        time relative to the start of the profile, the slice is included in the arguments of the event. The process and
+        thread IDs are those of the process the record was made in, so slices segmented in parallel show up side by
+        side with one row per worker.
+
+        Parameters
+        ----------
+        **info
+            Additional information to include in the metadata of the trace, e.g. the subject and scan format
+
+        Returns
+        -------
+        dict
+            Trace in the Chrome trace event format, can be viewed in chrome://tracing or https://ui.perfetto.dev
+        """
+
+        events = []
+        pids = []
+        for record in self.records:
+            if 'start' not in record:
+                continue
+
+            if record['pid'] not in pids:
+                pids.append(record['pid'])
+
+            event = {'name': record['stage'], 'cat': 'span' if record['span'] else 'stage', 'ph': 'X',
+                     'ts': (record['start'] - self.startWallTime) * 1e6, 'dur': record['wallTime'] * 1e6,
+                     'pid': record['pid'], 'tid': record['tid'], 'args': {'cpuTime': record['cpuTime']}}
+
+            if record['slice'] is not None:
+                event['args']['slice'] = record['slice']
+
+            events.append(event)
+
+        # Name the processes, the first one is the process that runs the segmentation and loads the data
+        for index, pid in enumerate(pids):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': 'segmentation' if index == 0 else 'worker %i' % index}})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': info}
+
+    def writeTrace(self, filename, **info):
+        """Write the stages and spans to a Chrome trace JSON file, see :meth:`trace`
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the JSON file to write
+        **info
+            Additional information to include in the metadata of the trace
+        """
+
+        with open(filename, 'w') as fh:
+            json.dump(self.trace(**info), fh)
+
+
+# Profiler of the current subject in this process
+_profiler = Profiler()
+
+
+def getProfiler():
+    """Get the profiler of the current subject
+
+    Returns
+    -------
+    Profiler
+        Profiler of the current subject in this process
+    """
+
+    return _profiler
+
+
+def reset():
+    """Start a new profile for the next subject
+
+    Returns
+    -------
+    Profiler
+        New profiler of the current subject
+    """
+
+    global _profiler
+    _profiler = Profiler()
+
+    return _profiler
+
+
+def stage(name, slice=None):
+    """Record a stage with the profiler of the current subject, see :meth:`Profiler.stage`"""
+
+    return _profiler.stage(name, slice)
+
+
+def count(name, value=1):
+    """Increment the number of times an event occurred with the profiler of the current subject, see
+    :meth:`Profiler.count`"""
+
+    _profiler.count(name, value)
+
+
+def span(name, slice=None):
+    """Record a span with the profiler of the current subject if tracing, see :meth:`Profiler.span`"""
+
+    return _profiler.span(name, slice)
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect the stages recorded within a with statement separately from the profiler of the current subject
+
+    This is used to time the stages of a slice, which may be segmented in a worker process that does not share the
+    profiler of the parent process. The records are returned along with the results of the slice and added to the
+    profiler of the subject with :meth:`Profiler.extend`.
+
+    Returns
+    -------
+    context manager
+        Yields the list that the records are added to
+    """
+
+    global _profiler
+    parentProfiler = _profiler
+    _profiler = Profiler()
+
+    try:
+        yield _profiler.records
+    finally:
+        _profiler = parentProfiler
@@ -1,47 +1,758 @@
+import os
+
+import nrrd
 import numpy as np
+import scipy.ndimage
+import skimage.morphology
 import sklearn.cluster
 
+from util import constants
+from util import draw
+from util import profiling
+from util.parallel import getWorkerCount, mapSlices
+
+
+class KMeansWarmStart:
+    """Warm start K-means clustering of consecutive slices from the centroids of the previous slice
+
+    Adjacent slices have nearly the same intensity distribution, so the converged centroids of one slice are a good
+    initialization for the next one. Each slice is clustered with a single run of Lloyd's algorithm starting from the
+    previous centroids. A full fit (k-means++ initialization with restarts) is performed instead for the first slice
+    and whenever the warm started run does not converge or the centroids move more than :obj:`tolerance`.
+
+    Pass an instance to :meth:`kmeans` for each slice of the volume, in order. Keep a separate instance for each volume.
+
+    Parameters
+    ----------
+    tolerance : float, optional
+        Maximum distance any centroid may move from the previous slice before falling back to a full fit (default is
+        None, uses :obj:`constants.kMeansWarmStartTolerance`)
+    maxIterations : int, optional
+        Maximum number of iterations for a warm started run. The run is considered to have failed to converge if it
+        reaches this limit (default is None, uses :obj:`constants.kMeansWarmStartMaxIterations`)
+    """
+
+    def __init__(self, tolerance=None, maxIterations=None):
+        self.tolerance = constants.kMeansWarmStartTolerance if tolerance is None else tolerance
+        self.maxIterations = constants.kMeansWarmStartMaxIterations if maxIterations is None else maxIterations
+
+        # Centroids of the last slice clustered, None until the first slice is clustered
+        self.centroids = None
+
+        # Statistics of the number of fits and iterations
+        # Only the iterations of the best run are reported by scikit-learn for a full fit, so the full fit iterations
+        # are an underestimate of the actual work done
+        self.warmFits = 0
+        self.fullFits = 0
+        self.warmFitIterations = 0
+        self.fullFitIterations = 0
+
+    @property
+    def iterationsSaved(self):
+        # Estimate of the number of iterations saved compared to performing a full fit on every slice
+        # Uses the average number of iterations from the full fits that were performed
+        if self.fullFits == 0:
+            return 0
+
+        return int(round(self.fullFitIterations / self.fullFits * self.warmFits - self.warmFitIterations))
+
+    def __str__(self):
+        return '%i warm started fits, %i full fits, approximately %i iterations saved' % \
+               (self.warmFits, self.fullFits, self.iterationsSaved)
+
+    def fit(self, data, k):
+        if self.centroids is not None and len(self.centroids) == k:
+            centroids, labels, inertia, iterations = sklearn.cluster.k_means(data, k, init=self.centroids, n_init=1,
+                                                                             max_iter=self.maxIterations,
+                                                                             return_n_iter=True)
+
+            # Use the warm started result if it converged and did not drift too far from the previous slice
+            if iterations < self.maxIterations and np.abs(centroids - self.centroids).max() <= self.tolerance:
+                self.centroids = centroids
+                self.warmFits += 1
+                self.warmFitIterations += iterations
+
+                return centroids, labels
+
+        # Seed the random initialization and use 10 restarts, see kmeans for more information
+        centroids, labels, inertia, iterations = sklearn.cluster.k_means(data, k, random_state=0, n_init=10,
+                                                                         return_n_iter=True)
+
+        self.centroids = centroids
+        self.fullFits += 1
+        self.fullFitIterations += iterations
+
+        return centroids, labels
+
+
+def kmeans(image, k, isVector=False, warmStart=None):
+    # Use the exact histogram-based solution when it applies, see kmeansExact for more information
+    # There are no iterations to save with the exact solution, so warmStart is not used
+    if constants.kMeansBackend == 'exact' and k == 2 and not isVector:
+        return kmeansExact(image)
 
-def kmeans(image, k, isVector=False):
     # Flatten the image so that all of the values are in an array
     # If the image is a vector, then do not combine the last dimension
     flattenedImage = image.reshape(-1, image.shape[-1] if isVector else 1)
 
-    centroids, labels, inertia = sklearn.cluster.k_means(flattenedImage, k)
+    if warmStart is not None:
+        centroids, labels = warmStart.fit(flattenedImage, k)
+    else:
+        # Seed the random initialization so that the result for a slice does not depend on which slices were clustered
+        # before it in the same process. This keeps serial and parallel runs identical
+        # The number of restarts is given explicitly because its default changed from 10 to a single run in
+        # scikit-learn 1.4, this keeps the result the same for all versions of scikit-learn
+        centroids, labels, inertia = sklearn.cluster.k_means(flattenedImage, k, random_state=0, n_init=10)
+
     labelOrder = np.argsort(centroids.sum(axis=1))
 
     return labelOrder, centroids, labels.reshape(image.shape[:-1] if isVector else image.shape)
 
 
+def kmeansExact(image):
+    """Exact K-means clustering of scalar values into two clusters
+
+    For one-dimensional data, the optimal clusters are contiguous ranges of the sorted values. So for k = 2, the optimal
+    clustering is found by trying every split point between the unique values and selecting the one with the smallest
+    within-cluster sum of squares. This is done in a single pass over the cumulative sums of the unique values rather
+    than running Lloyd's algorithm from multiple random initializations.
+
+    Parameters
+    ----------
+    image : :class:`numpy.ndarray`
+        Scalar image of any shape to cluster
+
+    Returns
+    -------
+    labelOrder : (2,) :class:`numpy.ndarray`
+        Labels sorted from smallest to largest centroid, always [0, 1] since label 0 is the lower cluster
+    centroids : (2, 1) :class:`numpy.ndarray`
+        Mean value of each cluster
+    labels : :class:`numpy.ndarray`
+        Cluster label for each value, same shape as :obj:`image`
+    """
+
+    # Get the sorted unique values along with the number of times each value appears
+    # inverse maps each value of the image to its index in the unique values
+    values, inverse, counts = np.unique(image.ravel(), return_inverse=True, return_counts=True)
+
+    # All values are the same, so there is nothing to split. Place everything in the lower cluster
+    if len(values) < 2:
+        centroids = np.array([[values[0]], [values[0]]], dtype=float)
+        return np.arange(2), centroids, np.zeros(image.shape, np.int32)
+
+    # Number of values and sum of values at or below each split point
+    # The last unique value is excluded since splitting there would leave the upper cluster empty
+    lowerCount = np.cumsum(counts)[:-1]
+    lowerSum = np.cumsum(values * counts)[:-1]
+    upperCount = image.size - lowerCount
+    upperSum = (values * counts).sum() - lowerSum
+
+    # Minimizing the within-cluster sum of squares is equivalent to maximizing the between-cluster sum of squares, which
+    # is n1 * n2 / n * (mean1 - mean2)^2. The constant n is dropped since it does not change the location of the maximum
+    lowerMean = lowerSum / lowerCount
+    upperMean = upperSum / upperCount
+    split = np.argmax(lowerCount * upperCount * (upperMean - lowerMean) ** 2)
+
+    centroids = np.array([[lowerMean[split]], [upperMean[split]]])
+    labels = (inverse.reshape(image.shape) > split).astype(np.int32)
+
+    return np.arange(2), centroids, labels
+
+
+def kmeansMask(image, k, warmStart=None):
+    # Segment image using K-means
+    # labelOrder contains the labels sorted from smallest intensity to greatest
+    # Since our k = 2, we want the higher intensity label at index 1
+    labelOrder, centroids, labels = kmeans(image, k, warmStart=warmStart)
+
+    return labels == labelOrder[1]
+
+
+def getKMeansWorkerCount(k):
+    """Get the number of worker processes :meth:`kmeansMasks` clusters the slices with
+
+    Parameters
+    ----------
+    k : int
+        Number of clusters
+
+    Returns
+    -------
+    int
+        1 if the slices are clustered in the current process, otherwise the number of slice workers, see
+        :meth:`getWorkerCount`
+    """
+
+    if constants.kMeansWarmStart or (constants.kMeansBackend == 'exact' and k == 2):
+        return 1
+
+    return getWorkerCount()
+
+
+def kmeansMasks(volume, k, slices):
+    """Segment each axial slice of a volume using K-means
+
+    If :obj:`constants.kMeansWarmStart` is True, the slices are clustered in order with each slice starting from the
+    centroids of the previous slice, see :class:`KMeansWarmStart`. Otherwise, the slices are independent and are spread
+    over the slice worker processes, unless the exact backend is used. The exact backend only takes a few milliseconds
+    per slice, which is less than the time to start a pool of worker processes and send the slices to it, so the slices
+    are clustered in the current process instead.
+
+    Parameters
+    ----------
+    volume : (Z, M, N) :class:`numpy.ndarray`
+        Volume to segment
+    k : int
+        Number of clusters
+    slices : range
+        Axial slices to segment
+
+    Returns
+    -------
+    masks : (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of the higher intensity cluster for each slice. Slices not in :obj:`slices` are all False
+    warmStart : :class:`KMeansWarmStart` or None
+        Warm start statistics for the volume or None if warm start is disabled
+    """
+
+    masks = np.zeros(volume.shape, bool)
+
+    if constants.kMeansWarmStart:
+        warmStart = KMeansWarmStart()
+
+        for slice in slices:
+            masks[slice, :, :] = kmeansMask(volume[slice, :, :], k, warmStart)
+    else:
+        warmStart = None
+
+        workers = getKMeansWorkerCount(k)
+        for slice, mask in zip(slices, mapSlices(kmeansMask, ((volume[slice, :, :], k) for slice in slices), workers)):
+            masks[slice, :, :] = mask
+
+    return masks, warmStart
+
+
+def inPlaneStructure(connectivity=1):
+    """Get a 3D structuring element that only connects pixels within the same axial slice
+
+    Parameters
+    ----------
+    connectivity : int, optional
+        Connectivity within each slice, 1 for 4-connectivity and 2 for 8-connectivity (default is 1)
+
+    Returns
+    -------
+    (3, 3, 3) :class:`numpy.ndarray`
+        Structuring element for use with :mod:`scipy.ndimage` on (Z, M, N) volumes
+    """
+
+    structure = np.zeros((3, 3, 3), bool)
+    structure[1] = scipy.ndimage.generate_binary_structure(2, connectivity)
+
+    return structure
+
+
+def createBodyMasks(fatImageMasks, waterImageMasks, slices):
+    """Create the body mask of each axial slice of a volume from the K-means masks
+
+    The body mask is the union of the fat and water masks, closed with a disk of radius 3 to connect any small gaps
+    (such as at the umbilical cord) and with all holes filled. The whole volume is processed at once using structuring
+    elements that only extend within each axial slice, so each slice is treated independently and the result is
+    identical to processing the slices one at a time.
+
+    Parameters
+    ----------
+    fatImageMasks : (Z, M, N) :class:`numpy.ndarray`
+        Binary fat mask of each slice
+    waterImageMasks : (Z, M, N) :class:`numpy.ndarray` or None
+        Binary water mask of each slice. If None, the body mask is created from the fat mask only
+    slices : range
+        Axial slices to create body masks for
+
+    Returns
+    -------
+    (Z, M, N) :class:`numpy.ndarray`
+        Body mask of each slice. Slices not in :obj:`slices` are all False
+    """
+
+    masks = np.zeros(fatImageMasks.shape, bool)
+
+    bodyMasks = fatImageMasks[slices.start:slices.stop]
+    if waterImageMasks is not None:
+        bodyMasks = bodyMasks | waterImageMasks[slices.start:slices.stop]
+
+    # Structuring elements only extend within each axial slice
+    bodyMasks = skimage.morphology.binary_closing(bodyMasks, skimage.morphology.disk(3)[np.newaxis])
+    bodyMasks = scipy.ndimage.binary_fill_holes(bodyMasks, inPlaneStructure())
+
+    masks[slices.start:slices.stop] = bodyMasks
+
+    return masks
+
+
+def createFatVoidMasks(fatImageMasks, slices):
+    """Create the fat void mask of each axial slice of a volume from the K-means fat masks
+
+    The fat void mask is the area enclosed by the fat mask that is not fat itself. It is found by filling the holes in
+    the fat mask and removing the fat mask from it. Like :meth:`createBodyMasks`, the whole volume is processed at once
+    but each slice is treated independently.
+
+    Parameters
+    ----------
+    fatImageMasks : (Z, M, N) :class:`numpy.ndarray`
+        Binary fat mask of each slice
+    slices : range
+        Axial slices to create fat void masks for
+
+    Returns
+    -------
+    (Z, M, N) :class:`numpy.ndarray`
+        Fat void mask of each slice. Slices not in :obj:`slices` are all False
+    """
+
+    masks = np.zeros(fatImageMasks.shape, bool)
+
+    fatImageMasks = fatImageMasks[slices.start:slices.stop]
+    filledMasks = scipy.ndimage.binary_fill_holes(fatImageMasks, inPlaneStructure())
+
+    masks[slices.start:slices.stop] = filledMasks & ~fatImageMasks
+
+    return masks
+
+
+def armCutCoordinates(armBounds, slices, shape, thickness=2):
+    """Get the coordinates of the lines that cut an arm away from the body in each axial slice
+
+    Arm bounds are lines given at a few axial positions. The endpoints of the line in every slice between the first and
+    last arm bound are linearly interpolated from the arm bounds. The endpoints for all of the slices are interpolated
+    at once and the pixels of each line are found once, so the lines can be cut from the body masks of the whole volume
+    with a single assignment, e.g. ``bodyMasks[armCutCoordinates(...)] = False``.
+
+    Parameters
+    ----------
+    armBounds : list of (5,) tuple
+        Arm bounds sorted by axial position. Each arm bound is (x1, y1, x2, y2, axialPosition) where (x1, y1) and
+        (x2, y2) are the endpoints of the line in Cartesian coordinates
+    slices : range
+        Axial slices to get the lines for. Slices outside of the first and last arm bound do not have a line
+    shape : (2,) tuple or list
+        Shape of each slice in C-order, meaning (height, width) format
+    thickness : int, optional
+        Thickness of the lines, see :meth:`draw.binaryLine` (default is 2)
+
+    Returns
+    -------
+    slices : (K,) :class:`numpy.ndarray`
+        Axial slice of each pixel of the lines
+    rows : (K,) :class:`numpy.ndarray`
+        Row (y) coordinate of each pixel of the lines
+    columns : (K,) :class:`numpy.ndarray`
+        Column (x) coordinate of each pixel of the lines
+    """
+
+    coordinates = [(np.empty(0, int), np.empty(0, int), np.empty(0, int))]
+
+    if len(armBounds) == 0:
+        return tuple(np.concatenate(x) for x in zip(*coordinates))
+
+    # Columns are x1, y1, x2, y2 and the axial position
+    armBounds = np.array(armBounds, dtype=float)
+
+    # Only draw a line if the slice is between the first and last arm bound axial slices specified
+    sliceNumbers = np.arange(slices.start, slices.stop)
+    sliceNumbers = sliceNumbers[(sliceNumbers >= armBounds[0, 4]) & (sliceNumbers <= armBounds[-1, 4])]
+
+    # Interpolate the endpoints for all of the slices between the bounds, round and convert to an integer
+    endpoints = np.column_stack([np.interp(sliceNumbers, armBounds[:, 4], armBounds[:, i]) for i in range(4)])
+    endpoints = np.round(endpoints).astype(int)
+
+    # Neighboring slices often have the same endpoints, so each unique line is only drawn once
+    lines = {}
+    for slice, (x1, y1, x2, y2) in zip(sliceNumbers, endpoints.tolist()):
+        if (x1, y1, x2, y2) not in lines:
+            lines[x1, y1, x2, y2] = draw.binaryLineCoordinates((x1, y1), (x2, y2), shape, thickness=thickness)
+
+        rows, columns = lines[x1, y1, x2, y2]
+        coordinates.append((np.full(len(rows), slice), rows, columns))
+
+    return tuple(np.concatenate(x) for x in zip(*coordinates))
+
+
+def fatVoidCorrectionCoordinates(fatVoidCorrections, slices, shape):
+    """Get the coordinates of the manual corrections to remove from the fat void masks of each axial slice
+
+    Large voids, such as the ones in the mammary glands, can cause the abdominal mask to be wrong. These are removed
+    from the fat void masks using polygons drawn over a range of slices, which are read from the configuration file.
+    The polygons of each correction are drawn once and the result is repeated for each slice in its range, so the
+    corrections can be applied to the fat void masks of the whole volume with a single assignment, e.g.
+    ``fatVoidMasks[fatVoidCorrectionCoordinates(...)] = False``.
+
+    Parameters
+    ----------
+    fatVoidCorrections : list of dict
+        Corrections from the configuration file. Each correction has an 'inferior' and 'superior' slice, inclusive, and
+        a list of 'polygons' where each polygon is a list of points in Cartesian coordinates (x, y)
+    slices : range
+        Axial slices to get the corrections for
+    shape : (2,) tuple or list
+        Shape of each slice in C-order, meaning (height, width) format
+
+    Returns
+    -------
+    slices : (K,) :class:`numpy.ndarray`
+        Axial slice of each pixel of the corrections
+    rows : (K,) :class:`numpy.ndarray`
+        Row (y) coordinate of each pixel of the corrections
+    columns : (K,) :class:`numpy.ndarray`
+        Column (x) coordinate of each pixel of the corrections
+    """
+
+    coordinates = [(np.empty(0, int), np.empty(0, int), np.empty(0, int))]
+
+    for correction in fatVoidCorrections:
+        # Slices of the correction that are being segmented
+        sliceNumbers = np.arange(max(correction['inferior'], slices.start),
+                                 min(correction['superior'] + 1, slices.stop))
+
+        if len(sliceNumbers) == 0 or len(correction['polygons']) == 0:
+            continue
+
+        # Draw the polygons once, each one is drawn separately since they can have a different number of points
+        mask = np.logical_or.reduce([draw.binaryFilledPolygon(polygon, shape) for polygon in correction['polygons']])
+        rows, columns = np.nonzero(mask)
+
+        coordinates.append((np.repeat(sliceNumbers, len(rows)), np.tile(rows, len(sliceNumbers)),
+                            np.tile(columns, len(sliceNumbers))))
+
+    return tuple(np.concatenate(x) for x in zip(*coordinates))
+
+
+def binaryOpeningDisk(mask, radius, backend=None):
+    """Morphological opening of a binary mask with a disk structuring element
+
+    The 'distance' backend finds the opening from two Euclidean distance transforms. A pixel is kept by the erosion if
+    the nearest pixel outside of the mask is further than :obj:`radius` away and added by the dilation if the nearest
+    eroded pixel is no more than :obj:`radius` away. This is the same as opening with :meth:`skimage.morphology.disk`,
+    including at the border of the image, but the cost does not grow with the size of the disk.
+
+    Parameters
+    ----------
+    mask : (M, N) :class:`numpy.ndarray`
+        Binary mask
+    radius : int
+        Radius of the disk
+    backend : str, optional
+        Either 'skimage' to use :meth:`skimage.morphology.binary_opening` or 'distance' to use distance transforms
+        (default is None, uses :obj:`constants.lungOpeningBackend`)
+
+    Returns
+    -------
+    (M, N) :class:`numpy.ndarray`
+        Opened binary mask
+    """
+
+    if backend is None:
+        backend = constants.lungOpeningBackend
+
+    if backend != 'distance':
+        return skimage.morphology.binary_opening(mask, skimage.morphology.disk(radius))
+
+    # Distance transform is not defined when there are no pixels outside of the mask, nothing is eroded in that case
+    mask = np.asarray(mask, dtype=bool)
+    if mask.all():
+        return mask.copy()
+
+    eroded = scipy.ndimage.distance_transform_edt(mask) > radius
+    if not eroded.any():
+        return eroded
+
+    return scipy.ndimage.distance_transform_edt(~eroded) <= radius
+
+
+def removeSmallObjects(masks, minArea):
+    """Remove objects smaller than a given area from each axial slice of a volume
+
+    Objects are the 4-connected components within each slice, the same as
+    :meth:`skimage.morphology.remove_small_objects` with the default connectivity applied to each slice. Objects with
+    an area less than :obj:`minArea` are removed.
+
+    Parameters
+    ----------
+    masks : (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of each slice
+    minArea : int or (Z,) array_like
+        Minimum area in pixels of an object for it to be kept, either for all slices or for each slice
+
+    Returns
+    -------
+    (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of each slice with objects smaller than :obj:`minArea` removed
+    """
+
+    minArea = np.broadcast_to(np.asarray(minArea), (masks.shape[0],))
+
+    # Label the objects of all slices at once using a structuring element that only connects pixels within a slice
+    labels, count = scipy.ndimage.label(masks, inPlaneStructure())
+
+    # Each object lies within a single slice, so the areas are counted one slice at a time. This gives the same areas as
+    # counting the whole volume at once but keeps the arrays small enough to stay in the CPU cache, which is faster
+    result = np.empty(masks.shape, bool)
+    for slice in range(masks.shape[0]):
+        areas = np.bincount(labels[slice].ravel())
+
+        # Lookup table of whether to keep each label, the background (label 0) is never kept
+        keep = areas >= minArea[slice]
+        keep[0] = False
+
+        result[slice] = keep[labels[slice]]
+
+    return result
+
+
+def largestComponent(masks, connectivity=2):
+    """Keep only the largest connected component of a 2D mask or of each axial slice of a volume
+
+    For a volume, all of the slices are labeled at once using a structuring element that only connects pixels within a
+    slice.
+
+    Parameters
+    ----------
+    masks : (M, N) or (Z, M, N) :class:`numpy.ndarray`
+        Binary mask or binary mask of each slice
+    connectivity : int, optional
+        Connectivity of the components within each slice, 1 for 4-connectivity and 2 for 8-connectivity (default is 2,
+        same as :meth:`skimage.measure.label`)
+
+    Returns
+    -------
+    (M, N) or (Z, M, N) :class:`numpy.ndarray`
+        Binary mask containing only the largest component of each slice. If there are multiple components with the
+        largest area, the first one labeled is kept. Slices without any components are all False
+    """
+
+    stack = masks if masks.ndim == 3 else masks[np.newaxis]
+
+    labels, labelCount = scipy.ndimage.label(stack, inPlaneStructure(connectivity))
+
+    result = np.zeros(stack.shape, bool)
+    for slice in range(stack.shape[0]):
+        # Labels from other slices have an area of zero here, so argmax always finds a label within this slice
+        areas = np.bincount(labels[slice].ravel())
+
+        if len(areas) > 1:
+            result[slice] = labels[slice] == np.argmax(areas[1:]) + 1
+
+    return result if masks.ndim == 3 else result[0]
+
+
+def splitLungs(lungMasks):
+    """Get the left and right lung of each axial slice of a volume from the lung masks
+
+    The two largest objects in each slice are the left and right lung. The lung with the smaller sagittal centroid
+    coordinate is the left lung. All of the slices are labeled at once using a structuring element that only connects
+    pixels within a slice.
+
+    Parameters
+    ----------
+    lungMasks : (Z, M, N) :class:`numpy.ndarray`
+        Binary lung mask of each slice
+
+    Returns
+    -------
+    leftLungs : (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of the left lung of each slice
+    rightLungs : (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of the right lung of each slice
+
+    Raises
+    ------
+    ValueError
+        If a slice has fewer than two objects in its lung mask
+    """
+
+    labels, labelCount = scipy.ndimage.label(lungMasks, inPlaneStructure(2))
+
+    leftLungs = np.zeros(lungMasks.shape, bool)
+    rightLungs = np.zeros(lungMasks.shape, bool)
+    for slice in range(lungMasks.shape[0]):
+        # Sort labels based on area descending, first two largest objects are the left/right lung
+        # Labels from other slices have an area of zero here, so they are always sorted after the objects of this slice
+        # Stable sort keeps objects with the same area in the order they were labeled
+        areas = np.bincount(labels[slice].ravel())[1:]
+        lungLabels = np.argsort(-areas, kind='stable')[:2] + 1
+
+        if len(lungLabels) < 2 or areas[lungLabels[-1] - 1] == 0:
+            raise ValueError('Unable to find the left and right lung in slice %i of the lung masks' % slice)
+
+        # Next, sort the two lungs based on their sagittal centroid coordinate
+        # Smaller sagittal centroid coordinate is the left lung, other is right lung
+        lungs = [labels[slice] == label for label in lungLabels]
+        leftLungs[slice], rightLungs[slice] = sorted(lungs, key=lambda lung: np.nonzero(lung)[0].mean())
+
+    return leftLungs, rightLungs
+
+
+def createCATMasks(leftLungs, rightLungs, posterior, anterior):
+    """Create the mask of where cardiac adipose tissue (CAT) can be located around the heart
+
+    From the coronal plane, the upper and lower bounds are the posterior and anterior rows. From the sagittal plane, the
+    bounds are calculated based on the lungs going around the heart. In each row, the CAT mask extends from the outer
+    edge of the left lung to the outer edge of the right lung. Rows without a left lung start at the leftmost outer edge
+    of the left lung between the posterior and anterior rows and rows without a right lung stop at the rightmost outer
+    edge of the right lung.
+
+    Parameters
+    ----------
+    leftLungs : (M, N) or (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of the left lung of a slice or of each slice
+    rightLungs : (M, N) or (Z, M, N) :class:`numpy.ndarray`
+        Binary mask of the right lung of a slice or of each slice
+    posterior : int or (Z,) :class:`numpy.ndarray`
+        First row of the CAT mask of a slice or of each slice
+    anterior : int or (Z,) :class:`numpy.ndarray`
+        Row after the last row of the CAT mask of a slice or of each slice
+
+    Returns
+    -------
+    (M, N) or (Z, M, N) :class:`numpy.ndarray`
+        CAT mask of a slice or of each slice
+    """
+
+    is2D = leftLungs.ndim == 2
+    if is2D:
+        leftLungs, rightLungs = leftLungs[np.newaxis], rightLungs[np.newaxis]
+
+    shape = leftLungs.shape
+    posterior = np.broadcast_to(posterior, shape[:1])[:, np.newaxis]
+    anterior = np.broadcast_to(anterior, shape[:1])[:, np.newaxis]
+
+    # Rows of each slice between the posterior and anterior bounds
+    rows = np.arange(shape[1])
+    heartRows = (rows >= posterior) & (rows < anterior)
+
+    # For the left and right lung, retrieve the outer contour index on a row-by-row basis.
+    # Left lung will be lower index and right-lung will be upper index for ROI of CAT
+    leftIndices = maxargwhere(leftLungs, axis=2)
+    rightIndices = minargwhere(rightLungs, axis=2)
+
+    # Any -1 values indicate there was no lung mask located there, so set it to the minimum (left) or maximum (right)
+    # index value between the posterior and anterior rows of the slice
+    leftFound = heartRows & (leftIndices != -1)
+    leftDefault = np.where(leftFound.any(axis=1), np.where(leftFound, leftIndices, shape[2]).min(axis=1), 0)
+    rightDefault = np.where(heartRows, rightIndices, -1).max(axis=1)
+
+    leftIndices = np.where(leftIndices == -1, leftDefault[:, np.newaxis], leftIndices)
+    rightIndices = np.where(rightIndices == -1, rightDefault[:, np.newaxis], rightIndices)
+
+    # If there is no right lung in any of the rows, then the index is still -1 and, like slicing up to -1, the mask
+    # stops at the last column
+    rightIndices[rightIndices == -1] = shape[2] - 1
+
+    columns = np.arange(shape[2])
+    masks = heartRows[:, :, np.newaxis] & (columns >= leftIndices[:, :, np.newaxis]) & \
+        (columns < rightIndices[:, :, np.newaxis])
+
+    return masks[0] if is2D else masks
+
+
+def writeNrrd(filename, data, header=None, **kwargs):
+    """Write an NRRD file, recording the write as a span of the trace if tracing is enabled
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the NRRD file to write, the name of the file is used as the name of the span
+    data : :class:`numpy.ndarray`
+        Data to write, see :meth:`nrrd.write`
+    header : dict, optional
+        Header of the NRRD file (default is None)
+    **kwargs
+        Other arguments passed to :meth:`nrrd.write`, e.g. compression_level
+    """
+
+    with profiling.span(os.path.basename(filename)):
+        nrrd.write(filename, data, header, **kwargs)
+
+
 def maxargwhere(array, axis=0):
-    def func(a):
-        x = np.argwhere(a)
-        return -1 if len(x) == 0 else x.max()
+    """Get the largest index of the nonzero elements along an axis
 
-    return np.apply_along_axis(func, axis, array)
+    Parameters
+    ----------
+    array : :class:`numpy.ndarray`
+        N-dimensional array, elements are interpreted as booleans
+    axis : int, optional
+        Axis to search along (default is 0)
+
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Array with :obj:`axis` removed containing the largest index of a nonzero element along :obj:`axis` or -1 if
+        there are no nonzero elements
+    """
+
+    array = np.asarray(array, dtype=bool)
+
+    # argmax returns the first True along the axis, so search the reversed array to get the last one
+    index = array.shape[axis] - 1 - np.argmax(np.flip(array, axis), axis=axis)
+
+    return np.where(array.any(axis=axis), index, -1)
 
 
 def minargwhere(array, axis=0):
-    def func(a):
-        x = np.argwhere(a)
-        return -1 if len(x) == 0 else x.min()
+    """Get the smallest index of the nonzero elements along an axis
+
+    Parameters
+    ----------
+    array : :class:`numpy.ndarray`
+        N-dimensional array, elements are interpreted as booleans
+    axis : int, optional
+        Axis to search along (default is 0)
 
-    return np.apply_along_axis(func, axis, array)
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Array with :obj:`axis` removed containing the smallest index of a nonzero element along :obj:`axis` or -1 if
+        there are no nonzero elements
+    """
+
+    array = np.asarray(array, dtype=bool)
+
+    return np.where(array.any(axis=axis), np.argmax(array, axis=axis), -1)
 
 
 def nearestargwhere(array, index=0, axis=0):
-    def func(a):
-        x = np.argwhere(a)
-        if len(x) == 0:
-            return -1
+    """Get the index of the nonzero element nearest to a given index along an axis
+
+    Parameters
+    ----------
+    array : :class:`numpy.ndarray`
+        N-dimensional array, elements are interpreted as booleans
+    index : int, optional
+        Index along :obj:`axis` to find the nearest nonzero element to (default is 0)
+    axis : int, optional
+        Axis to search along (default is 0)
 
-        minIndex = np.abs(x - index).argmin()
+    Returns
+    -------
+    :class:`numpy.ndarray`
+        Array with :obj:`axis` removed containing the index of the nonzero element nearest to :obj:`index` along
+        :obj:`axis` or -1 if there are no nonzero elements. If two elements are equally near, the smaller index is used
+    """
 
-        return x[minIndex]
+    array = np.asarray(array, dtype=bool)
+    axis = axis % array.ndim
 
-    return np.apply_along_axis(func, axis, array)
+    # Distance of each element from index along the axis, elements that are zero are given a distance larger than any
+    # real distance so they are never the nearest. argmin returns the first minimum, which is the smaller index on ties
+    shape = [1] * array.ndim
+    shape[axis] = array.shape[axis]
+    distance = np.abs(np.arange(array.shape[axis]) - index).reshape(shape)
+    distance = np.where(array, distance, array.shape[axis] + abs(index))
+
+    return np.where(array.any(axis=axis), np.argmin(distance, axis=axis), -1)
 
 
 def defaultmin(x, default):
     return default if x.size == 0 else x.min()
-